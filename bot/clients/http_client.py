@@ -0,0 +1,36 @@
+import aiohttp
+import logging
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class HttpClient:
+    """
+    Долгоживущая aiohttp-сессия с пулом keep-alive соединений.
+    Открывается в on_startup и закрывается в on_shutdown, чтобы не делать
+    TCP/TLS handshake к api.pyrus.com на каждый запрос.
+    """
+    _instance: aiohttp.ClientSession | None = None
+
+    @classmethod
+    async def get_instance(cls) -> aiohttp.ClientSession:
+        if cls._instance is None or cls._instance.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.HTTP_POOL_LIMIT,
+                limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+            )
+            cls._instance = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT),
+            )
+            logger.info("HTTP connection pool created")
+        return cls._instance
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._instance:
+            await cls._instance.close()
+            cls._instance = None
@@ -6,6 +6,7 @@ from bot.clients.redis_client import RedisClient
 from bot.handlers.closed_tasks import closed_tasks_router
 from bot.handlers.main_menu.main_menu import return_to_main_menu
 from bot.services.api_client import open_task_by_api
+from bot.services.reopen_windows import ReopenWindows
 from bot.states.closed_tasks import ClosedTasks
 from bot.texts.closed_tasks import ClosedTasksTexts
 from bot.texts.task_actions import TaskActionsMessages
@@ -33,7 +34,7 @@ async def open_task_handler(callback: types.CallbackQuery, state: FSMContext):
     if not success:
         await callback.answer(ClosedTasksTexts.ERROR_OPEN_TASK_TEXT, show_alert=True)
         return
-    await redis_client.delete(f"available_task:{user_id}:{task_id}")
+    await ReopenWindows.close(redis_client, user_id, task_id)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=ClosedTasksTexts.MAIN_MENU_TEXT, callback_data="open_task_back_to_main_menu")],
     ])
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 from typing import List
 
@@ -14,38 +13,34 @@ from bot.handlers.main_menu.main_menu import return_to_main_menu
 from bot.keyboards.closed_tasks import build_closed_tasks_keyboard
 from bot.keyboards.main_menu import MainMenuKeyboards
 from bot.services.pyrus_api_service import PyrusService
+from bot.services.reopen_windows import ReopenWindows
 from bot.states.closed_tasks import ClosedTasks
 from bot.texts.closed_tasks import ClosedTasksTexts
 from bot.texts.task_actions import TaskActionsMessages
 
 logger = logging.getLogger(__name__)
 
-async def check_task_validity(key: str) -> dict | None:
-    redis_client = await RedisClient.get_instance()
-    raw = await redis_client.get(key)
-    if not raw:
-        return None
-
+async def check_task_validity(user_id: int, data: dict) -> dict | None:
     try:
-        data = json.loads(raw)
         task_id = data["task_id"]
         task = await PyrusService.get_task_by_id(int(task_id))
         task_data = task.get("task")
         if not task_data.get("close_date"):  # нет закрытия → задача переоткрыта
-            await redis_client.delete(key)
+            redis_client = await RedisClient.get_instance()
+            await ReopenWindows.close(redis_client, user_id, task_id)
             return None
         return task_data
     except Exception as e:
-        logger.warning(f"Ошибка при проверке задачи {key}: {e}")
+        logger.warning(f"Ошибка при проверке задачи {data.get('task_id')} пользователя {user_id}: {e}")
         return None
 
 async def get_valid_available_tasks(user_id: int) -> List[dict]:
     redis_client = await RedisClient.get_instance()
-    keys = await redis_client.keys(f"available_task:{user_id}:*")
-    if not keys:
+    windows = await ReopenWindows.get_user_windows(redis_client, user_id)
+    if not windows:
         return []
 
-    tasks = await asyncio.gather(*(check_task_validity(key) for key in keys))
+    tasks = await asyncio.gather(*(check_task_validity(user_id, data) for data in windows))
     return [task for task in tasks if task is not None]
 
 
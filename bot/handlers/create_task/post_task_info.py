@@ -5,6 +5,7 @@ from bot.clients.bot_client import BotClient
 from bot.clients.redis_client import RedisClient
 from bot.services.file_service import FileService
 from bot.services.pyrus_api_service import PyrusService
+from bot.services.task_chat_index import TaskChatIndex
 from bot.texts.task_actions import TaskActionsMessages
 from bot.keyboards.main_menu import MainMenuKeyboards
 from bot.utils.get_item_by_value import get_value_by_item_id
@@ -43,7 +44,7 @@ async def handle_post_comment(message: types.Message, state: FSMContext):
                             reply_markup=ReplyKeyboardRemove())
 
         # Подготавливаем файлы для Pyrus
-        file_attachments = await prepare_file_attachments(files)
+        file_attachments = await prepare_file_attachments(files, user_id)
 
 
         if not file_attachments:
@@ -91,6 +92,8 @@ async def get_user_files_from_redis(user_id: int) -> List[Dict]:
     """Получает файлы пользователя из Redis"""
     redis = await RedisClient.get_instance()
     file_keys = await redis.keys(f"create_task_file_{user_id}_*")
+    # guid появится в хеше файла, когда закончится его фоновая загрузка
+    await FileService.wait_background_uploads(file_keys)
 
     files = []
     for key in file_keys:
@@ -100,7 +103,9 @@ async def get_user_files_from_redis(user_id: int) -> List[Dict]:
         file_data = await redis.hgetall(key)
         files.append({
             "file_id": file_data.get("file_id"),
-            "filename": file_data.get("filename")
+            "filename": file_data.get("filename"),
+            "file_unique_id": file_data.get("file_unique_id"),
+            "guid": file_data.get("guid"),
         })
 
     return files
@@ -108,13 +113,13 @@ async def get_user_files_from_redis(user_id: int) -> List[Dict]:
 
 
 
-async def prepare_file_attachments(files: List[Dict]) -> Optional[List]:
+async def prepare_file_attachments(files: List[Dict], user_id: int) -> Optional[List]:
     """Подготавливает файлы для отправки в Pyrus"""
     if not files:
         return None
 
     bot = BotClient.get_instance()
-    return await FileService.prepare_files(files=files, bot=bot)
+    return await FileService.prepare_files(files=files, bot=bot, user_id=user_id)
 
 
 
@@ -166,6 +171,8 @@ async def create_task_by_api(state, telegram_username: str, user_id: int, files:
     # Отправляем запрос в Pyrus
     result = await PyrusService.create_task(json_data)
     task_id = result.get("task").get("id")
+    # Получатель событий вебхука по этой задаче известен сразу
+    await TaskChatIndex.set(task_id, user_id)
     return task_id
 
 async def extract_task_data(state) -> Dict[str, Union[str, int]]:
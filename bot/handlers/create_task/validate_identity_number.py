@@ -2,7 +2,6 @@ from aiogram.filters import StateFilter
 
 from bot.clients.redis_client import RedisClient
 from bot.texts.create_task import CreateTaskMessages
-from bot.utils.task_utils import TaskUtils
 from bot.services.pyrus_api_service import PyrusService
 from bot.keyboards.create_task import CreateTaskKeyboards
 import logging
@@ -50,8 +49,7 @@ async def process_identity_number(
         return False
 
     # Получение и проверка подрядчиков
-    contractors = await PyrusService.get_contractors()
-    contractor_id = TaskUtils.is_data_verification(contractors, identity_number)
+    contractor_id = await PyrusService.find_contractor_id(identity_number)
 
     if not contractor_id:
         if is_answer_message:
@@ -75,8 +73,7 @@ async def process_identity_number(
     )
 
     # Поиск пользователя
-    users = await PyrusService.get_users()
-    task_id = TaskUtils.find_user_id(users, user_id)
+    task_id = await PyrusService.find_user_task_id(user_id)
 
     if task_id:
         await state.update_data(user_task_id=task_id)
@@ -58,6 +58,10 @@ async def handle_single_file(message: types.Message):
         result = await FileService.process_single_file(message, file_key, redis)
         if result:
             await message.reply(result)
+        else:
+            # Файл сразу передаётся в Pyrus; загрузка не держит счётчик обработки,
+            # её дожидается отправка задачи или комментария
+            FileService.start_background_upload(file_key, message.from_user.id)
 
     except Exception as e:
         logger.error(f"File processing error: {e}")
@@ -59,6 +59,8 @@ async def handle_post_comment(message: types.Message, state: FSMContext):
         text = data.get("comment_text")
         task_id = data.get("task_id")
         bot = BotClient.get_instance()
+        # guid появится в хеше файла, когда закончится его фоновая загрузка
+        await FileService.wait_background_uploads(keys)
         files = []
         for key in keys:
             if not await redis.exists(key):
@@ -66,13 +68,19 @@ async def handle_post_comment(message: types.Message, state: FSMContext):
             file_data = await redis.hgetall(key)
             files.append({
                 "file_id": file_data.get("file_id"),
-                "filename": file_data.get("filename")
+                "filename": file_data.get("filename"),
+                "file_unique_id": file_data.get("file_unique_id"),
+                "guid": file_data.get("guid"),
             })
         # Подготовка файлов
         file_ids = await FileService.prepare_files(
             files=files,
             bot=bot,
+            user_id=user_id,
         ) if files else None
+        if files and not file_ids:
+            await message.answer(CreateTaskMessages.MESSAGE_ERROR_PROCESS_FILES)
+            return
 
         task = await PyrusService.get_task_by_id(task_id)
         if not task:
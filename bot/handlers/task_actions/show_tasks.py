@@ -7,7 +7,6 @@ from bot.services.pyrus_api_service import PyrusService
 from bot.keyboards.main_menu import MainMenuKeyboards
 from bot.keyboards.task_actions import TaskActionsKeyboards
 from bot.texts.task_actions import TaskActionsMessages
-from bot.utils.task_utils import TaskUtils
 from . import task_actions_router
 from aiogram.filters import StateFilter
 
@@ -44,12 +43,8 @@ async def start_show_tasks_handler(callback: types.CallbackQuery, state: FSMCont
             await callback.answer()
             return
 
-        # Получение и фильтрация задач
-        all_tasks = await PyrusService.get_tasks()
-        user_tasks = TaskUtils.filter_tasks_by_username(
-            all_tasks,
-            callback.from_user.id
-        )
+        # Получение задач пользователя (фильтр на стороне Pyrus)
+        user_tasks = await PyrusService.get_user_tasks(callback.from_user.id)
 
         # Обработка случаев
         if not user_tasks:
@@ -5,18 +5,52 @@ from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.fsm.storage.base import DefaultKeyBuilder
 from aiogram.types import BotCommand
 from bot.clients.bot_client import BotClient
+from bot.clients.http_client import HttpClient
 from bot.clients.redis_client import RedisClient
 from config import settings
 from bot.handlers.main_menu import start_router
 from bot.scheduler import periodic_task_fetcher
+from bot.services.file_service import FileService
+from bot.services.leader_election import LeaderElection
+from bot.services.request_coalescer import RequestCoalescer
+from bot.services.telegram_delivery import TelegramDelivery
+from bot.services.pyrus_auth_service import TokenManager
+from bot.services.reopen_windows import ReopenWindows
+from bot.services.upload_scheduler import UploadScheduler
+from bot.utils.delete_keys_from_redis import delete_keys_by_pattern_async
 from bot.handlers.task_actions import task_actions_router
 from bot.handlers.create_task import create_task_router
 from bot.handlers.closed_tasks import closed_tasks_router
 
 logger = logging.getLogger(__name__)
 _periodic_task: asyncio.Task | None = None
+_token_refresh_task: asyncio.Task | None = None
+_delivery_task: asyncio.Task | None = None
+_metrics_task: asyncio.Task | None = None
 disp = None
 
+
+async def log_service_metrics():
+    """Раз в METRICS_LOG_INTERVAL секунд логирует счётчики сервисов процесса"""
+    while True:
+        await asyncio.sleep(settings.METRICS_LOG_INTERVAL)
+        try:
+            uploads = UploadScheduler.get_metrics()
+            coalescer = RequestCoalescer.get_stats()
+            guid_cache = FileService.guid_cache_stats
+            guid_lookups = guid_cache["hits"] + guid_cache["misses"]
+            logger.info(
+                f"Загрузки файлов: в очереди {uploads['queue_depth']}, активных {uploads['active']}, "
+                f"завершено {uploads['completed']:.0f}, ошибок {uploads['failed']:.0f}, повторов {uploads['retries']:.0f}, "
+                f"ожидание среднее {uploads['wait_time_avg']:.2f}с / максимальное {uploads['wait_time_max']:.2f}с; "
+                f"GET-запросы Pyrus: выполнено {coalescer['executed']}, объединено в процессе {coalescer['coalesced_local']}, "
+                f"через Redis {coalescer['coalesced_redis']}; "
+                f"кеш guid файлов: попаданий {guid_cache['hits']}, промахов {guid_cache['misses']} "
+                f"({guid_cache['hits'] / guid_lookups if guid_lookups else 0.0:.0%})"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось собрать метрики сервисов: {e}")
+
 async def on_startup():
     global disp
     if disp is None:
@@ -25,12 +59,19 @@ async def on_startup():
     print("▶️ on_startup fired")
     # Инициализация Redis и FSM storage
     redis = await RedisClient.get_instance()
-    await redis.flushall()
+    # Сбрасываем только временные данные диалогов: долговременные ключи
+    # (отметка опроса закрытых задач, окна переоткрытия, кеши) должны пережить перезапуск
+    for pattern in ("fsm:*", "media_processing:*", "file_*", "create_task_file_*"):
+        await delete_keys_by_pattern_async(redis, pattern)
+    # Окна переоткрытия, открытые до перехода на индекс ReopenWindows
+    await ReopenWindows.migrate_legacy(redis)
     storage = RedisStorage(
         redis=redis,
         key_builder=DefaultKeyBuilder(with_destiny=True),
     )
     disp.fsm_storage = storage
+    # Общий пул HTTP-соединений к Pyrus на всё время жизни процесса
+    await HttpClient.get_instance()
     BotClient.set_storage(storage)
     print(BotClient.storage)
     bot: Bot = BotClient.get_instance()
@@ -40,23 +81,35 @@ async def on_startup():
         BotCommand(command="cancel", description="Отмена"),
     ])
 
-    # Запуск фоновой задачи
+    # Запуск фоновой задачи: опрашивает Pyrus только ведущая реплика
     global _periodic_task
-    _periodic_task = asyncio.create_task(periodic_task_fetcher())
-    logger.info("🚀 periodic_task_fetcher запущен")
+    _periodic_task = asyncio.create_task(LeaderElection.run(redis, periodic_task_fetcher))
+    logger.info(f"🚀 periodic_task_fetcher запущен в режиме выбора ведущего (узел {LeaderElection.node_id})")
+
+    global _token_refresh_task
+    _token_refresh_task = asyncio.create_task(TokenManager.refresh_loop())
+
+    # Отправка уведомлений из очереди с учётом лимитов Telegram
+    global _delivery_task
+    _delivery_task = asyncio.create_task(TelegramDelivery.run())
+
+    global _metrics_task
+    _metrics_task = asyncio.create_task(log_service_metrics())
 
 async def on_shutdown():
     print("▶️ on_shutdown fired")
-    global _periodic_task
-    if _periodic_task:
-        _periodic_task.cancel()
-        try:
-            await _periodic_task
-        except asyncio.CancelledError:
-            pass
+    global _periodic_task, _token_refresh_task, _delivery_task, _metrics_task
+    for task in (_periodic_task, _token_refresh_task, _delivery_task, _metrics_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
 
     # Закрываем клиентов
     await BotClient.close()
+    await HttpClient.close()
     await RedisClient.close()
     logger.info("⛔ Бот остановлен")
 
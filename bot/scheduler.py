@@ -1,19 +1,27 @@
 import asyncio
+import time
 from datetime import datetime, timezone, timedelta
 
-from bot.clients.bot_client import BotClient
 from bot.clients.redis_client import RedisClient
 from bot.keyboards.create_task import CreateTaskKeyboards
 from bot.services.pyrus_api_service import PyrusService
-import json
+from bot.services.rate_limiter import set_background_priority
+from bot.services.reopen_windows import ReopenWindows
+from bot.services.telegram_delivery import TelegramDelivery
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
 from bot.texts.create_task import CreateTaskMessages
+from config import settings
 
 # Логгер
 logger = logging.getLogger(__name__)
 
+# Отметка closed_after, до которой закрытые задачи уже обработаны
+CLOSED_AFTER_WATERMARK_KEY = "scheduler:closed_after_watermark"
+# id задач, закрытых ровно в секунду отметки и уже обработанных
+CLOSED_AFTER_BOUNDARY_IDS_KEY = "scheduler:closed_after_boundary_ids"
+
 
 def extract_user_id(fields: List[Dict]) -> int | None:
     for field in fields:
@@ -21,54 +29,61 @@ def extract_user_id(fields: List[Dict]) -> int | None:
             return field.get("value")
     return None
 
-async def start_task_timer(task_id: int, closed_at: str, fields: List[Dict]):
-    """Запускает таймер для задачи в Redis."""
-
+def _reopen_window_expire_at(closed_at: str) -> datetime | None:
+    """Время истечения часового окна переоткрытия или None, если окно уже закрыто"""
     if not closed_at:
         return None
-
-    redis = await RedisClient.get_instance()
-
-    closed_time = datetime.fromisoformat(closed_at.replace("Z", "+00:00"))
-    expire_time = closed_time + timedelta(hours=1)
-
-    # Проверяем, не истёк ли уже срок
+    expire_time = _parse_pyrus_date(closed_at) + timedelta(hours=1)
     if datetime.now(timezone.utc) > expire_time:
-        return False
-
-    user_id = extract_user_id(fields)
-
-    if user_id is None:
-        return False
+        return None
+    return expire_time
 
-    # Проверяем, есть ли уже задача в Redis
-    existing_ttl = await redis.ttl(f"available_task:{user_id}:{task_id}")
+async def start_task_timers(tasks: List[Dict]) -> int:
+    """
+    Запускает таймеры для пачки закрытых задач: текущие окна читаются одним пайплайном,
+    новые/продлённые окна пишутся вторым. Возвращает число открытых или продлённых окон.
+    """
+    candidates = []
+    for task in tasks:
+        expire_time = _reopen_window_expire_at(task.get("close_date"))
+        fields = task.get("fields", [])
+        user_id = extract_user_id(fields)
+        if expire_time is None or user_id is None:
+            continue
+        candidates.append((user_id, task["id"], expire_time, fields))
+    if not candidates:
+        return 0
 
-    # Если задача уже есть и её TTL больше оставшегося времени - не обновляем
-    if existing_ttl > 0 and existing_ttl > (expire_time - datetime.now(timezone.utc)).total_seconds():
-        return True
+    redis = await RedisClient.get_instance()
+    existing = await ReopenWindows.get_expire_at_many(
+        redis, [(user_id, task_id) for user_id, task_id, _, _ in candidates]
+    )
 
+    windows = []
+    for (user_id, task_id, expire_time, fields), existing_expire_at in zip(candidates, existing):
+        # Если окно уже есть и истекает не раньше нового - не обновляем
+        if existing_expire_at is not None and existing_expire_at >= expire_time.timestamp():
+            continue
+        value = {
+            "task_id": task_id,
+            "fields": fields,
+        }
+        windows.append((user_id, task_id, expire_time.timestamp(), value))
 
+    await ReopenWindows.open_many(redis, windows)
+    if windows:
+        logger.info(f"Таймеры переоткрытия запущены/продлены: {len(windows)} из {len(tasks)} задач")
+    return len(windows)
 
-    # Сохраняем/обновляем задачу с новым TTL
-    ttl_seconds = (expire_time - datetime.now(timezone.utc)).total_seconds()
-    value = json.dumps({
-        "task_id": task_id,
-        "fields": fields,
-    })
-    await redis.setex(f"available_task:{user_id}:{task_id}", int(ttl_seconds), value)
-    logger.info(f"Таймер для задачи с id {task_id} был успешно запущен! Общее количество секунд: {ttl_seconds}")
-    return True
+async def start_task_timer(task_id: int, closed_at: str, fields: List[Dict]):
+    """Запускает таймер для задачи в Redis."""
+    return await start_task_timers([{"id": task_id, "close_date": closed_at, "fields": fields}]) > 0
 
-async def log_all_task_ttls(redis):
-    cursor = "0"
-    pattern = "available_task:*"
-    while cursor != 0:
-        cursor, keys = await redis.scan(cursor=cursor, match=pattern, count=1000)
-        for key in keys:
-            ttl = await redis.ttl(key)
-            logger.info(f"[{datetime.now().isoformat()}] KEY={key} TTL={ttl}s")
-        cursor = int(cursor)
+async def log_task_window_gauges(redis):
+    """Логирует число открытых окон переоткрытия и время до ближайшего истечения"""
+    count, nearest_in = await ReopenWindows.gauges(redis)
+    nearest = f"{nearest_in:.0f}s" if nearest_in is not None else "-"
+    logger.info(f"Окна переоткрытия: открыто={count}, ближайшее истечение через {nearest}")
 
 
 async def post_comment_to_user(task, fields):
@@ -99,29 +114,165 @@ async def post_comment_to_user(task, fields):
 
     await PyrusService.post_comment_value_fields(task_id, payload)
 
-    # Шаг 4: формируем сообщение и отправляем
-    bot = BotClient.get_instance()
-
+    # Шаг 4: формируем сообщение и ставим в очередь отправки
     type_problem = field_map.get(1)
     message = CreateTaskMessages.get_completion_task_message(task_id, type_problem)
-    await bot.send_message(chat_id=user_id, text=message, reply_markup=CreateTaskKeyboards.service_quality_keyboard(task_id))
+    await TelegramDelivery.enqueue(
+        chat_id=user_id, text=message, reply_markup=CreateTaskKeyboards.service_quality_keyboard(task_id)
+    )
+
+
+
+async def notify_closed_tasks(tasks: List[Dict]) -> None:
+    """Отправляет сообщения о завершении параллельно, не больше CLOSED_TASKS_NOTIFY_CONCURRENCY одновременно"""
+    semaphore = asyncio.Semaphore(settings.CLOSED_TASKS_NOTIFY_CONCURRENCY)
+
+    async def notify(task: Dict) -> None:
+        async with semaphore:
+            try:
+                await post_comment_to_user(task, task.get("fields", []))
+            except Exception as e:
+                # Ошибка доставки одному пользователю не должна останавливать отметку
+                logger.exception(f"Ошибка обработки закрытой задачи {task.get('id')}: {e}")
+
+    await asyncio.gather(*(notify(task) for task in tasks))
+
+
+async def handle_task_state_change(task: Dict) -> None:
+    """
+    Обрабатывает закрытие/переоткрытие задачи из события вебхука:
+    при закрытии открывает часовое окно переоткрытия и отправляет сообщение о завершении,
+    при переоткрытии убирает окно.
+    """
+    task_id = task.get("id")
+    fields = task.get("fields", [])
+    comments = task.get("comments") or []
+    last_action = next((c for c in reversed(comments) if c.get("action")), None)
+    if not task_id or last_action is None:
+        return
+
+    if last_action["action"] == "finished" and (task.get("is_closed") or task.get("close_date")):
+        close_date = task.get("close_date") or last_action.get("create_date")
+        await start_task_timer(task_id, close_date, fields)
+        await post_comment_to_user(task, fields)
+        logger.info(f"Задача {task_id} закрыта — обработано по вебхуку")
+
+    elif last_action["action"] == "reopened":
+        user_id = extract_user_id(fields)
+        if user_id is not None:
+            redis = await RedisClient.get_instance()
+            await ReopenWindows.close(redis, user_id, task_id)
+        logger.info(f"Задача {task_id} переоткрыта — окно переоткрытия снято")
+
+
+def _parse_pyrus_date(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _format_pyrus_date(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _close_second(task: Dict) -> int:
+    """Время закрытия задачи с точностью до секунды (как в фильтрах Pyrus)"""
+    return int(_parse_pyrus_date(task["close_date"]).timestamp())
+
+
+async def _fetch_complete_window(lo: int, hi: int) -> Optional[Tuple[List[Dict], int]]:
+    """
+    Задачи, закрытые в [lo, hi] (unix-секунды), и граница hi, до которой ответ полный.
+    Pyrus отдаёт страницу без сортировки, поэтому по полной странице нельзя понять, какие задачи
+    в неё не попали: окно сужается вдвое, а если сужать некуда (всё закрыто в одну секунду) —
+    растёт размер страницы. None — при ошибке запроса.
+    """
+    item_count = settings.CLOSED_TASKS_BATCH_SIZE
+    while True:
+        # Границы с запасом в секунду: включительность фильтров Pyrus не важна, лишнее отсекаем сами
+        tasks = await PyrusService.get_closed_tasks(
+            _format_pyrus_date(datetime.fromtimestamp(lo - 1, timezone.utc)),
+            closed_before=_format_pyrus_date(datetime.fromtimestamp(hi + 1, timezone.utc)),
+            item_count=item_count,
+        )
+        if tasks is None:
+            return None
+        if len(tasks) < item_count:
+            closed = [task for task in tasks if task.get("close_date") and lo <= _close_second(task) <= hi]
+            return closed, hi
+        if hi - lo > 1:
+            hi = lo + (hi - lo) // 2
+        else:
+            item_count *= 2
+
+
+async def process_closed_tasks_since_watermark(redis) -> int:
+    """
+    Обрабатывает закрытые задачи окнами не больше CLOSED_TASKS_BATCH_SIZE задач начиная
+    с сохранённого в Redis closed_after. Отметка сдвигается только до границы, до которой
+    все задачи уже получены и обработаны, поэтому после простоя бот догоняет пропущенное.
+    Задачи, закрытые ровно в секунду отметки, запоминаются по id, чтобы не обработать их дважды.
+    Возвращает число обработанных задач.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(CLOSED_AFTER_WATERMARK_KEY)
+        pipe.smembers(CLOSED_AFTER_BOUNDARY_IDS_KEY)
+        watermark, boundary_ids = await pipe.execute()
+    if watermark is None:
+        default_start = datetime.now(timezone.utc) - timedelta(seconds=settings.CLOSED_TASKS_RECONCILE_INTERVAL + 30)
+        watermark, boundary_ids = _format_pyrus_date(default_start), set()
+    lo = int(_parse_pyrus_date(watermark).timestamp())
+    # Текущую секунду не берём: в неё ещё могут закрыться задачи
+    upper = int(time.time()) - 1
+
+    processed = 0
+    started_at = time.perf_counter()
+    while lo < upper:
+        window = await _fetch_complete_window(lo, upper)
+        if window is None:
+            logger.warning(f"Не удалось получить закрытые задачи после {watermark}, отметка не сдвинута")
+            break
+        tasks, hi = window
+
+        new_tasks = sorted(
+            (task for task in tasks if not (_close_second(task) == lo and str(task["id"]) in boundary_ids)),
+            key=lambda task: (_close_second(task), task["id"]),
+        )
+        await start_task_timers(new_tasks)
+        await notify_closed_tasks(new_tasks)
+        processed += len(new_tasks)
+
+        # Все задачи до hi включительно получены — сдвигаем отметку
+        lo = hi
+        boundary_ids = {str(task["id"]) for task in tasks if _close_second(task) == hi}
+        watermark = _format_pyrus_date(datetime.fromtimestamp(hi, timezone.utc))
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(CLOSED_AFTER_WATERMARK_KEY, watermark)
+            pipe.delete(CLOSED_AFTER_BOUNDARY_IDS_KEY)
+            if boundary_ids:
+                pipe.sadd(CLOSED_AFTER_BOUNDARY_IDS_KEY, *boundary_ids)
+            await pipe.execute()
 
+    if processed:
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            f"Обработано закрытых задач: {processed} за {elapsed:.2f}с "
+            f"({processed / elapsed if elapsed else 0:.1f} задач/с), отметка: {watermark}"
+        )
+    return processed
 
 
 async def periodic_task_fetcher():
+    """
+    Сверка закрытых задач. Основной путь — события вебхука (handle_task_state_change),
+    опрос лишь подбирает пропущенные события раз в CLOSED_TASKS_RECONCILE_INTERVAL секунд.
+    """
+    # Опрос Pyrus уступает квоту запросам пользователей
+    set_background_priority()
     redis = await RedisClient.get_instance()
+    interval = settings.CLOSED_TASKS_RECONCILE_INTERVAL
     while True:
         try:
-            closed_after = (datetime.now(timezone.utc) - timedelta(seconds=30)).isoformat()
-            tasks = await PyrusService.get_closed_tasks(closed_after)
-            for task in tasks:
-                fields = task.get("fields", {})
-                close_date = task.get("close_date")
-                if not close_date:
-                    continue
-                await start_task_timer(task["id"], close_date, fields)
-                await post_comment_to_user(task, fields)
-            await log_all_task_ttls(redis)
+            await process_closed_tasks_since_watermark(redis)
+            await log_task_window_gauges(redis)
         except Exception as e:
             logger.exception(f"Ошибка при периодическом получении задач: {e}")
-        await asyncio.sleep(10)
\ No newline at end of file
+        await asyncio.sleep(interval)
\ No newline at end of file
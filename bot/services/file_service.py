@@ -1,18 +1,26 @@
 from aiogram import types
 from config import settings
 import asyncio
-import io
 import logging
 from typing import List, Dict, Optional
 from aiogram import Bot
 
+from bot.clients.bot_client import BotClient
+from bot.clients.redis_client import RedisClient
 from bot.services.pyrus_api_service import PyrusService
+from bot.services.upload_scheduler import UploadScheduler
 
 logger = logging.getLogger(__name__)
 
+FILE_GUID_REDIS_KEY = "pyrus:file_guid:{file_unique_id}"
+
 
 class FileService:
     MAX_FILE_SIZE = settings.MAX_FILE_SIZE_MB * 1024 * 1024  # Конвертируем МБ в байты
+    # Попадания/промахи кеша file_unique_id -> guid Pyrus
+    guid_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0}
+    # Фоновые загрузки по ключу файла: держат ссылки на задачи и позволяют дождаться их при отправке
+    _background_uploads: Dict[str, asyncio.Task] = {}
 
     @staticmethod
     async def process_single_file(
@@ -22,7 +30,7 @@ class FileService:
     ) -> str | None:
         """Обработка файлов с правильной проверкой размера"""
         try:
-            file_id, filename, file_size = FileService.identify_file_data(message)
+            file_id, filename, file_size, file_unique_id = FileService.identify_file_data(message)
             if not file_id:
                 return "⚠️ Неподдерживаемый тип файла"
 
@@ -34,6 +42,7 @@ class FileService:
                 mapping={
                     "file_id": file_id,
                     "filename": filename,
+                    "file_unique_id": file_unique_id,
                 }
             )
 
@@ -45,18 +54,22 @@ class FileService:
 
     @staticmethod
     def identify_file_data(message: types.Message) -> tuple:
-        """Определение file_id и имени файла"""
+        """Определение file_id, имени файла, размера и file_unique_id"""
         if message.photo:
             file = message.photo[-1]
-            return file.file_id, f"photo_{file.file_id}.jpg", file.file_size
+            return file.file_id, f"photo_{file.file_id}.jpg", file.file_size, file.file_unique_id
         elif message.document:
-            return message.document.file_id, message.document.file_name, message.document.file_size
+            document = message.document
+            return document.file_id, document.file_name, document.file_size, document.file_unique_id
         elif message.audio:
-            return message.audio.file_id, f"audio_{message.audio.file_id}.mp3", message.audio.file_size
+            audio = message.audio
+            return audio.file_id, f"audio_{audio.file_id}.mp3", audio.file_size, audio.file_unique_id
         elif message.voice:
-            return message.voice.file_id, f"voice_{message.voice.file_id}.ogg", message.voice.file_size
+            voice = message.voice
+            return voice.file_id, f"voice_{voice.file_id}.ogg", voice.file_size, voice.file_unique_id
         elif message.video:
-            return message.video.file_id, f"video_{message.video.file_id}.mp4", message.video.file_size
+            video = message.video
+            return video.file_id, f"video_{video.file_id}.mp4", video.file_size, video.file_unique_id
         elif message.sticker:  # Добавляем обработку стикеров
             sticker = message.sticker
             # Определяем формат на основе типа стикера
@@ -66,36 +79,134 @@ class FileService:
                 ext = "webm"
             else:  # Статичные стикеры (WEBP)
                 ext = "webp"
-            return sticker.file_id, f"sticker_{sticker.file_id}.{ext}", sticker.file_size
-        return None, None, None
+            return sticker.file_id, f"sticker_{sticker.file_id}.{ext}", sticker.file_size, sticker.file_unique_id
+        return None, None, None, None
 
 
     @staticmethod
-    async def prepare_files(files: List[Dict], bot: Bot) -> Optional[List[str]]:
-        """Подготавливает файлы для отправки в Pyrus"""
+    async def prepare_files(files: List[Dict], bot: Bot, user_id: int = 0) -> Optional[List[str]]:
+        """
+        Подготавливает файлы для отправки в Pyrus через общий UploadScheduler.
+        Файлы, уже загруженные в фоне (есть guid), повторно не загружаются.
+        Возвращает None, если хотя бы один файл не удалось загрузить после повторов.
+        """
         if not files:
             return None
         tasks = []
         for file in files:
-            tasks.append(FileService._process_file(file["file_id"], file["filename"], bot))
+            if file.get("guid"):
+                tasks.append(FileService._ready(file["guid"]))
+                continue
+            tasks.append(UploadScheduler.submit(
+                user_id,
+                lambda file=file: FileService._process_file(
+                    file["file_id"], file["filename"], bot, file.get("file_unique_id")
+                )
+            ))
 
         try:
             results = await asyncio.gather(*tasks)
-            return [file_id for file_id in results if file_id]
         except Exception as e:
             logger.error(f"File preparation error: {e}")
             return None
 
+        failed = [file["filename"] for file, file_id in zip(files, results) if not file_id]
+        if failed:
+            logger.error(f"Failed to upload files for user {user_id}: {failed}")
+            return None
+        return list(results)
+
+    @staticmethod
+    def start_background_upload(file_key: str, user_id: int) -> asyncio.Task:
+        """
+        Сразу после получения файла запускает его передачу Telegram -> Pyrus в фоне
+        и записывает guid в хеш файла пользователя.
+        """
+        async def upload() -> None:
+            try:
+                redis = await RedisClient.get_instance()
+                file_data = await redis.hgetall(file_key)
+                if not file_data:
+                    return
+                bot = BotClient.get_instance()
+                guid = await UploadScheduler.submit(
+                    user_id,
+                    lambda: FileService._process_file(
+                        file_data.get("file_id"), file_data.get("filename"), bot, file_data.get("file_unique_id")
+                    )
+                )
+                # Пользователь мог сбросить файлы, пока шла загрузка
+                if guid and await redis.exists(file_key):
+                    await redis.hset(file_key, "guid", guid)
+            except Exception as e:
+                logger.error(f"Background upload of {file_key} failed: {e}")
+
+        task = asyncio.create_task(upload())
+        FileService._background_uploads[file_key] = task
+        task.add_done_callback(lambda _: FileService._background_uploads.pop(file_key, None))
+        return task
+
     @staticmethod
-    async def _process_file(file_id: str, filename: str, bot: Bot) -> Optional[str]:
-        """Обрабатывает один файл"""
+    async def wait_background_uploads(file_keys: List[str]) -> None:
+        """
+        Дожидается фоновых загрузок этих файлов перед отправкой.
+        Файлы, загрузка которых не удалась или шла в другой реплике, prepare_files загрузит заново.
+        """
+        uploads = [FileService._background_uploads[key] for key in file_keys if key in FileService._background_uploads]
+        if uploads:
+            await asyncio.wait(uploads)
+
+    @staticmethod
+    async def _ready(guid: str) -> str:
+        return guid
+
+    @staticmethod
+    async def _process_file(file_id: str, filename: str, bot: Bot, file_unique_id: Optional[str] = None) -> Optional[str]:
+        """
+        Обрабатывает один файл: тело скачивания из Telegram передаётся в запрос
+        загрузки в Pyrus кусками по FILE_STREAM_CHUNK_SIZE, не собираясь в памяти целиком.
+        Повторно присланный файл (тот же file_unique_id) берётся из кеша без скачивания и загрузки.
+        """
         try:
+            if file_unique_id and (guid := await FileService.get_cached_guid(file_unique_id)):
+                return guid
+
             file = await bot.get_file(file_id)
-            file_bytes = io.BytesIO()
-            await bot.download_file(file.file_path, destination=file_bytes)
-            file_bytes.seek(0)
-            a =  await PyrusService.get_unique_file_id(file_bytes, filename)
-            return a
+            url = bot.session.api.file_url(bot.token, file.file_path)
+            stream = bot.session.stream_content(
+                url=url,
+                chunk_size=settings.FILE_STREAM_CHUNK_SIZE,
+                raise_for_status=True,
+            )
+            guid = await PyrusService.get_unique_file_id(stream, filename)
+            if guid and file_unique_id:
+                await FileService.save_cached_guid(file_unique_id, guid)
+            return guid
         except Exception as e:
             logger.error(f"Failed to process file {filename}: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    @staticmethod
+    async def get_cached_guid(file_unique_id: str) -> Optional[str]:
+        """Ищет guid Pyrus для уже загруженного файла Telegram"""
+        try:
+            redis = await RedisClient.get_instance()
+            guid = await redis.get(FILE_GUID_REDIS_KEY.format(file_unique_id=file_unique_id))
+        except Exception as e:
+            logger.error(f"Error reading file guid cache: {e}")
+            return None
+        FileService.guid_cache_stats["hits" if guid else "misses"] += 1
+        return guid
+
+    @staticmethod
+    async def save_cached_guid(file_unique_id: str, guid: str) -> None:
+        """Запоминает guid Pyrus для файла Telegram на FILE_GUID_CACHE_TTL"""
+        try:
+            redis = await RedisClient.get_instance()
+            await redis.set(
+                FILE_GUID_REDIS_KEY.format(file_unique_id=file_unique_id),
+                guid,
+                ex=settings.FILE_GUID_CACHE_TTL,
+            )
+        except Exception as e:
+            logger.error(f"Error saving file guid cache: {e}")
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from redis.asyncio import Redis
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+LEADER_KEY = "scheduler:leader"
+
+# Продлевает аренду, только если она всё ещё принадлежит этому узлу
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Снимает аренду, только если она принадлежит этому узлу
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderElection:
+    """
+    Выбор ведущей реплики бота для фоновых задач через аренду в Redis.
+    - аренда — ключ LEADER_KEY со значением node_id и сроком LEADER_LEASE_SECONDS;
+    - ведущий продлевает её каждые LEADER_RENEW_INTERVAL секунд, остальные пытаются её захватить;
+    - если ведущий пропал, другая реплика становится ведущей не позже чем через срок аренды;
+    - если продлить аренду не удалось, фоновая задача останавливается до следующего захвата.
+    """
+    node_id: str = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    is_leader: bool = False
+    _renew_script = None
+    _release_script = None
+
+    @classmethod
+    async def run(cls, redis: Redis, job: Callable[[], Awaitable[None]]) -> None:
+        """Выполняет job, пока этот узел ведущий; при потере аренды — отменяет и ждёт нового захвата"""
+        job_task: Optional[asyncio.Task] = None
+        try:
+            while True:
+                try:
+                    if cls.is_leader:
+                        cls.is_leader = await cls._renew(redis)
+                        if not cls.is_leader:
+                            logger.warning(f"Узел {cls.node_id} потерял аренду ведущего")
+                    else:
+                        cls.is_leader = await cls._acquire(redis)
+                        if cls.is_leader:
+                            logger.info(f"Узел {cls.node_id} стал ведущим")
+                except Exception as e:
+                    logger.error(f"Ошибка выбора ведущего: {e}")
+                    cls.is_leader = False
+
+                if cls.is_leader and (job_task is None or job_task.done()):
+                    job_task = asyncio.create_task(job())
+                elif not cls.is_leader and job_task is not None:
+                    await cls._cancel(job_task)
+                    job_task = None
+
+                await asyncio.sleep(settings.LEADER_RENEW_INTERVAL)
+        finally:
+            if job_task is not None:
+                await cls._cancel(job_task)
+            if cls.is_leader:
+                await cls.release(redis)
+
+    @classmethod
+    async def release(cls, redis: Redis) -> None:
+        """Отдаёт аренду при остановке, чтобы другая реплика подхватила работу сразу"""
+        cls.is_leader = False
+        try:
+            if cls._release_script is None:
+                cls._release_script = redis.register_script(_RELEASE_SCRIPT)
+            await cls._release_script(keys=[LEADER_KEY], args=[cls.node_id])
+            logger.info(f"Узел {cls.node_id} снял аренду ведущего")
+        except Exception as e:
+            logger.error(f"Не удалось снять аренду ведущего: {e}")
+
+    @classmethod
+    async def status(cls, redis: Redis) -> Dict:
+        """Текущий ведущий узел и сколько секунд осталось до конца его аренды"""
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(LEADER_KEY)
+            pipe.pttl(LEADER_KEY)
+            leader, ttl_ms = await pipe.execute()
+        return {
+            "leader": leader,
+            "lease_expires_in": ttl_ms / 1000 if leader and ttl_ms > 0 else None,
+            "node_id": cls.node_id,
+            "is_leader": leader == cls.node_id,
+        }
+
+    @classmethod
+    async def _acquire(cls, redis: Redis) -> bool:
+        lease_ms = settings.LEADER_LEASE_SECONDS * 1000
+        return bool(await redis.set(LEADER_KEY, cls.node_id, nx=True, px=lease_ms))
+
+    @classmethod
+    async def _renew(cls, redis: Redis) -> bool:
+        if cls._renew_script is None:
+            cls._renew_script = redis.register_script(_RENEW_SCRIPT)
+        lease_ms = settings.LEADER_LEASE_SECONDS * 1000
+        return bool(await cls._renew_script(keys=[LEADER_KEY], args=[cls.node_id, lease_ms]))
+
+    @staticmethod
+    async def _cancel(task: asyncio.Task) -> None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception(f"Фоновая задача ведущего завершилась с ошибкой: {e}")
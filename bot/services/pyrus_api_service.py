@@ -2,15 +2,34 @@ import asyncio
 import json
 import logging
 import aiohttp
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import List, Dict, Optional, Any
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, \
+    wait_random_exponential
 from config import settings
+from bot.clients.http_client import HttpClient
+from bot.services.register_cache import RegisterCache
+from bot.services.register_index import RegisterIndex
+from bot.services.request_coalescer import RequestCoalescer
 from bot.utils.build_payload import build_payload
-from bot.services.pyrus_auth_service import get_valid_token, delete_token_from_cache, \
-    save_token_to_cache, fetch_new_token
+from bot.services.pyrus_auth_service import get_valid_token, TokenManager
+from bot.services.rate_limiter import RateLimiter
 from aiohttp import FormData
 
 logger = logging.getLogger(__name__)
 
+_BACKOFF = wait_random_exponential(multiplier=0.5, max=10)
+
+
+class PyrusRetryableError(Exception):
+    """Ответ Pyrus, после которого запрос можно повторить (429, 5xx)"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"Pyrus responded {status}")
+        self.status = status
+        self.retry_after = retry_after
+
 
 class PyrusService:
     # Конфигурация API endpoints
@@ -24,8 +43,71 @@ class PyrusService:
 
     _REQUEST_TIMEOUT = 5.0
 
+    # Поля формы задач: 1 — тема, 72 — Telegram id пользователя
+    _TASK_SUBJECT_FIELD_ID = 1
+    _TASK_USER_ID_FIELD_ID = 72
+
+    # Индексы реестров для поиска за O(1)
+    _contractors_by_inn = RegisterIndex("Dadata Inn")
+    _users_by_user_id = RegisterIndex("user_id")
+
     @classmethod
     async def _make_request(
+            cls,
+            endpoint: str,
+            method: str = "GET",
+            json_data: Optional[Dict] = None,
+            timeout: Optional[int] = None,
+            data: Optional[FormData] = None,
+            idempotent: Optional[bool] = None
+    ) -> Any:
+        """
+        idempotent — можно ли повторять запрос при обрыве соединения и 5xx.
+        По умолчанию так считаются только GET; POST-чтения реестров передают idempotent=True
+        """
+        # Одинаковые конкурентные GET-запросы выполняются один раз
+        if method.upper() == "GET":
+            return await RequestCoalescer.run(
+                f"GET {endpoint}",
+                lambda: cls._perform_request(endpoint, method, json_data, timeout, data, idempotent)
+            )
+        return await cls._perform_request(endpoint, method, json_data, timeout, data, idempotent)
+
+    @classmethod
+    async def _perform_request(
+            cls,
+            endpoint: str,
+            method: str = "GET",
+            json_data: Optional[Dict] = None,
+            timeout: Optional[int] = None,
+            data: Optional[FormData] = None,
+            idempotent: Optional[bool] = None
+    ) -> Any:
+        """Выполняет запрос с ограничением частоты и повторами при 429/5xx"""
+        is_idempotent = method.upper() == "GET" if idempotent is None else idempotent
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(settings.PYRUS_RETRY_ATTEMPTS),
+            wait=cls._retry_wait,
+            retry=retry_if_exception(lambda e: cls._is_retryable(e, is_idempotent, data)),
+            reraise=True,
+        )
+        try:
+            result = None
+            async for attempt in retrying:
+                with attempt:
+                    result = await cls._send_request(endpoint, method, json_data, timeout, data)
+            return result
+
+        except PyrusRetryableError as e:
+            logger.error(f"Request failed: {e.status} {cls._API_BASE}{endpoint}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Network error: {type(e).__name__} - {str(e)}")
+        except Exception as e:
+            logger.exception(f"Unexpected error: {str(e)}")
+        return None
+
+    @classmethod
+    async def _send_request(
             cls,
             endpoint: str,
             method: str = "GET",
@@ -33,6 +115,7 @@ class PyrusService:
             timeout: Optional[int] = None,
             data: Optional[FormData] = None
     ) -> Any:
+        """Одна попытка запроса. 429 и 5xx выбрасываются как PyrusRetryableError"""
         token = await get_valid_token()
         if not token:
             return None
@@ -40,36 +123,89 @@ class PyrusService:
         headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
         url = f"{cls._API_BASE}{endpoint}"
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                # Выполняем первоначальный запрос
-                if method.upper() == "GET":
-                    async with session.get(url, headers=headers, timeout=timeout) as response:
-                        return await cls._handle_request_with_token_refresh(
-                            session, response, endpoint, method, json_data, timeout, data
-                        )
-
-                elif method.upper() == "POST":
-                    if data:
-                        async with session.post(url, data=data, headers=headers, timeout=timeout) as response:
-                            return await cls._handle_request_with_token_refresh(
-                                session, response, endpoint, method, json_data, timeout, data
-                            )
-                    else:
-                        async with session.post(url, json=json_data, headers=headers, timeout=timeout) as response:
-                            return await cls._handle_request_with_token_refresh(
-                                session, response, endpoint, method, json_data, timeout, data
-                            )
-
-                logger.error(f"Unsupported HTTP method: {method}")
-                return None
+        await RateLimiter.acquire()
+        session = await HttpClient.get_instance()
+        request_timeout = cls._client_timeout(timeout)
+        # Выполняем первоначальный запрос
+        if method.upper() == "GET":
+            async with session.get(url, headers=headers, timeout=request_timeout) as response:
+                cls._raise_for_retry(response)
+                return await cls._handle_request_with_token_refresh(
+                    session, response, endpoint, method, json_data, timeout, data, token
+                )
+
+        elif method.upper() == "POST":
+            if data:
+                async with session.post(url, data=data, headers=headers, timeout=request_timeout) as response:
+                    cls._raise_for_retry(response)
+                    return await cls._handle_request_with_token_refresh(
+                        session, response, endpoint, method, json_data, timeout, data, token
+                    )
+            else:
+                async with session.post(url, json=json_data, headers=headers, timeout=request_timeout) as response:
+                    cls._raise_for_retry(response)
+                    return await cls._handle_request_with_token_refresh(
+                        session, response, endpoint, method, json_data, timeout, data, token
+                    )
 
-        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logger.error(f"Network error: {type(e).name} - {str(e)}")
-        except Exception as e:
-            logger.exception(f"Unexpected error: {str(e)}")
+        logger.error(f"Unsupported HTTP method: {method}")
         return None
 
+    @staticmethod
+    def _client_timeout(timeout: Optional[float]) -> aiohttp.ClientTimeout:
+        """
+        Явный таймаут запроса: aiohttp превращает переданный timeout=None в запрос без таймаута,
+        перекрывая таймаут сессии, поэтому None заменяем на HTTP_REQUEST_TIMEOUT
+        """
+        return aiohttp.ClientTimeout(total=timeout or settings.HTTP_REQUEST_TIMEOUT)
+
+    @staticmethod
+    def _raise_for_retry(response: aiohttp.ClientResponse) -> None:
+        """Превращает 429 и 5xx в исключение для механизма повторов"""
+        if response.status == 429 or response.status >= 500:
+            retry_after = PyrusService._parse_retry_after(response.headers.get("Retry-After"))
+            logger.warning(f"Pyrus responded {response.status}, retry after: {retry_after}")
+            raise PyrusRetryableError(response.status, retry_after)
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Retry-After бывает числом секунд или HTTP-датой"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _is_retryable(exc: BaseException, is_idempotent: bool, data: Optional[FormData]) -> bool:
+        """
+        429 — запрос не выполнен, повторяем любой (кроме multipart: FormData одноразовая).
+        5xx и сетевые ошибки — только идемпотентные запросы.
+        Retry-After больше PYRUS_RETRY_AFTER_MAX — не ждём, сразу возвращаем ошибку.
+        """
+        if isinstance(exc, PyrusRetryableError):
+            if exc.retry_after is not None and exc.retry_after > settings.PYRUS_RETRY_AFTER_MAX:
+                logger.error(f"Pyrus Retry-After {exc.retry_after:.0f}s exceeds {settings.PYRUS_RETRY_AFTER_MAX}s, giving up")
+                return False
+            if exc.status == 429:
+                return data is None
+            return is_idempotent
+        return is_idempotent and isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    @staticmethod
+    def _retry_wait(retry_state: RetryCallState) -> float:
+        """Retry-After от сервера (не больше PYRUS_RETRY_AFTER_MAX), иначе экспоненциальная задержка с джиттером"""
+        exc = retry_state.outcome.exception()
+        if isinstance(exc, PyrusRetryableError) and exc.retry_after is not None:
+            return min(exc.retry_after, settings.PYRUS_RETRY_AFTER_MAX)
+        return _BACKOFF(retry_state)
+
     @classmethod
     async def _handle_request_with_token_refresh(
             cls,
@@ -79,7 +215,8 @@ class PyrusService:
             method: str,
             json_data: Optional[Dict] = None,
             timeout: Optional[int] = None,
-            data: Optional[FormData] = None
+            data: Optional[FormData] = None,
+            stale_token: Optional[str] = None
     ) -> Any:
         """Обрабатывает ответ, обновляя токен при необходимости"""
         # Если ответ не 401, просто обрабатываем его
@@ -91,16 +228,12 @@ class PyrusService:
             )
 
         logger.info("Token expired, fetching new one...")
-        await delete_token_from_cache()
 
-        # Получаем новый токен
-        if not (new_token_data := await fetch_new_token()):
+        # Одновременные 401 приводят к одному обновлению токена
+        if not (new_token := await TokenManager.invalidate(stale_token)):
             logger.error("Failed to refresh token after 401")
             return None
 
-        await save_token_to_cache(new_token_data)
-        new_token = new_token_data["access_token"]
-
         # Формируем новые заголовки
         headers = {
             "Authorization": f"Bearer {new_token}",
@@ -111,7 +244,7 @@ class PyrusService:
         request_params = {
             "url": f"{cls._API_BASE}{endpoint}",
             "headers": headers,
-            "timeout": timeout or cls._REQUEST_TIMEOUT
+            "timeout": cls._client_timeout(timeout)
         }
 
         # Добавляем данные в зависимости от типа запроса
@@ -124,6 +257,7 @@ class PyrusService:
 
         # Выполняем повторный запрос
         try:
+            await RateLimiter.acquire()
             if method.upper() == "GET":
                 async with session.get(**request_params) as retry_response:
                     return await cls._handle_response(retry_response, request_params['url'])
@@ -180,21 +314,48 @@ class PyrusService:
 
     @classmethod
     async def get_items(cls) -> List[Dict]:
-        """Получение элементов каталога"""
-        data = await cls._make_request(cls._ENDPOINTS['items'])
-        return data.get('items', []) if data else []
+        """Получение элементов каталога (через кеш)"""
+        return await RegisterCache.get('items', cls._fetch_items) or []
 
     @classmethod
     async def get_contractors(cls) -> List[Dict]:
-        """Получение списка подрядчиков"""
-        data = await cls._make_request(cls._ENDPOINTS['contractors'])
-        return data.get('tasks', []) if data else []
+        """Получение списка подрядчиков (через кеш)"""
+        return await RegisterCache.get('contractors', cls._fetch_contractors) or []
 
     @classmethod
     async def get_users(cls) -> List[Dict]:
-        """Получение списка пользователей"""
+        """Получение списка пользователей (через кеш)"""
+        return await RegisterCache.get('users', cls._fetch_users) or []
+
+    @classmethod
+    async def find_contractor_id(cls, inn: str) -> Optional[int]:
+        """Поиск id подрядчика по ИНН через индекс реестра"""
+        contractors = await cls.get_contractors()
+        return cls._contractors_by_inn.lookup(contractors, inn)
+
+    @classmethod
+    async def find_user_task_id(cls, user_id: str) -> Optional[int]:
+        """Поиск id задачи пользователя по Telegram user_id через индекс реестра"""
+        users = await cls.get_users()
+        return cls._users_by_user_id.lookup(users, user_id)
+
+    @classmethod
+    async def _fetch_items(cls) -> Optional[List[Dict]]:
+        """Загрузка элементов каталога из Pyrus, None при ошибке"""
+        data = await cls._make_request(cls._ENDPOINTS['items'])
+        return data.get('items', []) if data else None
+
+    @classmethod
+    async def _fetch_contractors(cls) -> Optional[List[Dict]]:
+        """Загрузка реестра подрядчиков из Pyrus, None при ошибке"""
+        data = await cls._make_request(cls._ENDPOINTS['contractors'])
+        return data.get('tasks', []) if data else None
+
+    @classmethod
+    async def _fetch_users(cls) -> Optional[List[Dict]]:
+        """Загрузка реестра пользователей из Pyrus, None при ошибке"""
         data = await cls._make_request(cls._ENDPOINTS['users'])
-        return data.get('tasks', []) if data else []
+        return data.get('tasks', []) if data else None
 
     @classmethod
     async def get_tasks(cls) -> List[Dict]:
@@ -202,6 +363,21 @@ class PyrusService:
         data = await cls._make_request(cls._ENDPOINTS['tasks'])
         return data.get('tasks', []) if data else []
 
+    @classmethod
+    async def get_user_tasks(cls, user_id: int) -> List[Dict]:
+        """
+        Получение открытых задач одного пользователя.
+        Фильтрация и выбор полей выполняются на стороне Pyrus,
+        поэтому размер ответа зависит только от задач пользователя.
+        """
+        json_data = {
+            f"fld{cls._TASK_USER_ID_FIELD_ID}": str(user_id),
+            "field_ids": [cls._TASK_SUBJECT_FIELD_ID, cls._TASK_USER_ID_FIELD_ID],
+            "include_archived": "n",
+        }
+        data = await cls._make_request(cls._ENDPOINTS['tasks'], method="POST", json_data=json_data, idempotent=True)
+        return data.get('tasks', []) if data else []
+
     @classmethod
     async def create_task(cls, json_data) -> List[Dict]:
         """Создание задачи в Pyrus по API"""
@@ -214,7 +390,10 @@ class PyrusService:
 
     @classmethod
     async def get_unique_file_id(cls, file_bytes, filename):
-        """Получение id файла при его загрузке по API в Pyrus"""
+        """
+        Получение id файла при его загрузке по API в Pyrus.
+        file_bytes — файловый объект или асинхронный итератор кусков (потоковая загрузка).
+        """
         form = FormData(quote_fields=False)
         form.add_field(
             name='file',
@@ -228,7 +407,7 @@ class PyrusService:
             method="POST",
             data=form
         )
-        return result.get("guid")
+        return result.get("guid") if result else None
 
     @classmethod
     async def post_comment_files(cls, task_id: int, text: Optional[str], files: Optional[List[str]]):
@@ -241,11 +420,43 @@ class PyrusService:
 
 
     @classmethod
-    async def get_closed_tasks(cls, closed_after: str):
+    async def get_closed_tasks(cls, closed_after: str, closed_before: Optional[str] = None,
+                               item_count: Optional[int] = None) -> Optional[List[Dict]]:
+        """
+        Задачи, закрытые после closed_after и до closed_before (не больше item_count, без сортировки).
+        None — при ошибке запроса
+        """
         json_data = {"closed_after": closed_after}
+        if closed_before:
+            json_data["closed_before"] = closed_before
+        if item_count:
+            json_data["item_count"] = item_count
         form_id = settings.FORM_TASKS_ID
-        result = await cls._make_request(endpoint=f"/forms/{form_id}/register", method="POST", json_data=json_data)
-        return result.get("tasks", [])
+        result = await cls._make_request(
+            endpoint=f"/forms/{form_id}/register", method="POST", json_data=json_data, idempotent=True
+        )
+        return result.get("tasks", []) if result else None
+
+    @classmethod
+    async def comment_task(
+            cls,
+            task_id: int,
+            text: Optional[str] = None,
+            action: Optional[str] = None,
+            field_updates: Optional[List[Dict]] = None
+    ):
+        """
+        Один комментарий к задаче, объединяющий текст, действие (reopened/finished)
+        и изменение полей — вместо нескольких отдельных запросов
+        """
+        json_data = {}
+        if text:
+            json_data["text"] = text
+        if action:
+            json_data["action"] = action
+        if field_updates:
+            json_data["field_updates"] = field_updates
+        return await cls._make_request(endpoint=f"/tasks/{task_id}/comments", method="POST", json_data=json_data)
 
     @classmethod
     async def close_task(cls, task_id: int, text: str = None):
@@ -1,16 +1,17 @@
 import json
 import logging
+import time
 from typing import Optional, Dict
 import aiohttp
 import asyncio
+from bot.clients.http_client import HttpClient
 from bot.clients.redis_client import RedisClient
 from config import settings
 
-# Предполагается, что RedisClient — асинхронный клиент с методами get/set/delete
 # settings — объект с LOGIN, SECURITY_KEY, PERSON_ID
-# logger — объект для логов
 
 TOKEN_REDIS_KEY = "pyrus:access_token"
+TOKEN_LOCK_REDIS_KEY = "pyrus:access_token:lock"
 
 logger = logging.getLogger(__name__)
 
@@ -23,16 +24,18 @@ async def fetch_new_token() -> Optional[Dict]:
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    "https://accounts.pyrus.com/api/v4/auth",
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                response.raise_for_status()
-                token_data = await response.json()
-                # Не добавляем expires_at
-                return token_data
+        session = await HttpClient.get_instance()
+        async with session.post(
+                "https://accounts.pyrus.com/api/v4/auth",
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            response.raise_for_status()
+            token_data = await response.json()
+            # Pyrus не всегда возвращает срок жизни — считаем его сами
+            lifetime = int(token_data.get("expires_in") or settings.PYRUS_TOKEN_TTL)
+            token_data["expires_at"] = time.time() + lifetime
+            return token_data
     except Exception as e:
         logger.error(f"Failed to fetch new token: {str(e)}")
         return None
@@ -52,10 +55,11 @@ async def get_token_from_cache() -> Optional[Dict]:
 
 
 async def save_token_to_cache(token_data: Dict) -> None:
-    """Сохраняем токен в Redis без TTL"""
+    """Сохраняем токен в Redis до истечения его срока"""
     try:
         redis_client = await RedisClient.get_instance()
-        await redis_client.set(TOKEN_REDIS_KEY, json.dumps(token_data))
+        ttl = int(token_data.get("expires_at", 0) - time.time())
+        await redis_client.set(TOKEN_REDIS_KEY, json.dumps(token_data), ex=ttl if ttl > 0 else None)
     except Exception as e:
         logger.error(f"Error saving token to cache: {str(e)}")
 
@@ -69,76 +73,126 @@ async def delete_token_from_cache() -> None:
         logger.error(f"Error deleting token from cache: {str(e)}")
 
 
-async def get_valid_token() -> Optional[str]:
+class TokenManager:
     """
-    Получить валидный токен.
-    Если в кеше нет токена — получить новый и сохранить.
+    Токен Pyrus в памяти процесса со сроком жизни.
+    - обновляется заранее, за PYRUS_TOKEN_REFRESH_MARGIN секунд до истечения;
+    - обновляет ровно одна корутина: в процессе — asyncio.Lock,
+      в кластере — Redis-lock, остальные ждут и берут уже обновлённый токен из Redis.
     """
-    token_data = await get_token_from_cache()
-    if token_data is None:
+    _token_data: Optional[Dict] = None
+    _lock: Optional[asyncio.Lock] = None
+    _background_refresh: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def get_token(cls) -> Optional[str]:
+        """Возвращает валидный токен, при необходимости обновляя его"""
+        token_data = cls._token_data
+        if not cls._is_valid(token_data):
+            token_data = await cls._refresh()
+        elif cls._needs_refresh(token_data):
+            # Токен ещё действует — обновляем в фоне, не задерживая запрос
+            if cls._background_refresh is None or cls._background_refresh.done():
+                cls._background_refresh = asyncio.create_task(cls._refresh())
+        return token_data.get("access_token") if token_data else None
+
+    @classmethod
+    async def invalidate(cls, stale_token: Optional[str]) -> Optional[str]:
+        """
+        Вызывается при 401. Обновляет токен, только если stale_token всё ещё текущий —
+        так одновременные 401 приводят к одному обновлению.
+        """
+        async with cls._get_lock():
+            current = cls._token_data
+            if current and current.get("access_token") != stale_token and cls._is_valid(current):
+                return current.get("access_token")
+            cls._token_data = None
+            cached = await get_token_from_cache()
+            if cached and cached.get("access_token") != stale_token and cls._is_valid(cached):
+                cls._token_data = cached
+                return cached.get("access_token")
+            token_data = await cls._fetch_with_cluster_lock(stale_token)
+        return token_data.get("access_token") if token_data else None
+
+    @classmethod
+    async def refresh_loop(cls) -> None:
+        """Фоновая задача: обновляет токен до его истечения, даже если запросов нет"""
+        while True:
+            try:
+                token_data = cls._token_data if cls._is_valid(cls._token_data) else await cls._refresh()
+                if token_data:
+                    delay = token_data["expires_at"] - settings.PYRUS_TOKEN_REFRESH_MARGIN - time.time()
+                    if delay <= 0:
+                        refreshed = await cls._refresh(force=True)
+                        # Повторяем сразу, только если новый токен ещё не пора обновлять,
+                        # иначе (ошибка, истёкший или слишком короткий токен) — пауза, чтобы не долбить Pyrus
+                        if refreshed and not cls._needs_refresh(refreshed):
+                            continue
+                        delay = 30
+                else:
+                    delay = 30
+            except Exception as e:
+                logger.error(f"Error in token refresh loop: {str(e)}")
+                delay = 30
+            await asyncio.sleep(delay)
+
+    @classmethod
+    async def _refresh(cls, force: bool = False) -> Optional[Dict]:
+        async with cls._get_lock():
+            # Пока ждали блокировку, токен мог обновить другой вызывающий
+            if not force and cls._is_valid(cls._token_data) and not cls._needs_refresh(cls._token_data):
+                return cls._token_data
+
+            cached = await get_token_from_cache()
+            if not force and cls._is_valid(cached) and not cls._needs_refresh(cached):
+                cls._token_data = cached
+                return cached
+
+            stale = cls._token_data.get("access_token") if cls._token_data else None
+            token_data = await cls._fetch_with_cluster_lock(stale)
+            return token_data or (cls._token_data if cls._is_valid(cls._token_data) else None)
+
+    @classmethod
+    async def _fetch_with_cluster_lock(cls, stale_token: Optional[str]) -> Optional[Dict]:
+        """Получает новый токен под Redis-lock, чтобы в кластере обновлял один узел"""
+        try:
+            redis_client = await RedisClient.get_instance()
+            async with redis_client.lock(TOKEN_LOCK_REDIS_KEY, timeout=30, blocking_timeout=15):
+                cached = await get_token_from_cache()
+                if cached and cached.get("access_token") != stale_token \
+                        and cls._is_valid(cached) and not cls._needs_refresh(cached):
+                    cls._token_data = cached
+                    return cached
+                return await cls._fetch_and_store()
+        except Exception as e:
+            logger.error(f"Token lock error, refreshing without it: {str(e)}")
+            return await cls._fetch_and_store()
+
+    @classmethod
+    async def _fetch_and_store(cls) -> Optional[Dict]:
         token_data = await fetch_new_token()
-        if token_data:
-            await save_token_to_cache(token_data)
-        else:
+        if not token_data:
             return None
-    return token_data.get("access_token")
+        cls._token_data = token_data
+        await save_token_to_cache(token_data)
+        logger.info("Pyrus token refreshed successfully")
+        return token_data
 
+    @staticmethod
+    def _is_valid(token_data: Optional[Dict]) -> bool:
+        return bool(token_data) and token_data.get("expires_at", 0) > time.time()
 
-async def call_pyrus_api(endpoint: str, method="GET", **kwargs):
-    """
-    Пример вызова Pyrus API с автоматическим обновлением токена при 401.
-    """
-    token = await get_valid_token()
-    if not token:
-        logger.error("No valid Pyrus token available")
-        return None
-
-    headers = kwargs.pop("headers", {})
-    headers["Authorization"] = f"Bearer {token}"
+    @staticmethod
+    def _needs_refresh(token_data: Dict) -> bool:
+        return token_data.get("expires_at", 0) - settings.PYRUS_TOKEN_REFRESH_MARGIN <= time.time()
 
-    url = f"https://api.pyrus.com/{endpoint}"
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.request(method, url, headers=headers, **kwargs) as response:
-                if response.status == 401:
-                    # Токен просрочен или недействителен — обновляем
-                    logger.info("Token expired, fetching new one...")
-                    await delete_token_from_cache()
-                    new_token_data = await fetch_new_token()
-                    if new_token_data:
-                        await save_token_to_cache(new_token_data)
-                        # Повторяем запрос с новым токеном
-                        headers["Authorization"] = f"Bearer {new_token_data['access_token']}"
-                        async with session.request(method, url, headers=headers, **kwargs) as retry_response:
-                            retry_response.raise_for_status()
-                            return await retry_response.json()
-                    else:
-                        logger.error("Failed to refresh token after 401")
-                        return None
-                else:
-                    response.raise_for_status()
-                    return await response.json()
 
-    except Exception as e:
-        logger.error(f"Pyrus API call failed: {str(e)}")
-        return None
-
-
-async def periodic_token_refresh(interval_minutes=30):
-    """
-    Фоновая задача для обновления токена раз в interval_minutes.
-    Можно запускать на старте приложения.
-    """
-    while True:
-        try:
-            new_token_data = await fetch_new_token()
-            if new_token_data:
-                await save_token_to_cache(new_token_data)
-                logger.info("Pyrus token refreshed successfully")
-            else:
-                logger.warning("Failed to refresh Pyrus token in periodic task")
-        except Exception as e:
-            logger.error(f"Error in periodic token refresh: {str(e)}")
-
-        await asyncio.sleep(interval_minutes * 60)
+async def get_valid_token() -> Optional[str]:
+    """Получить валидный токен из TokenManager"""
+    return await TokenManager.get_token()
@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+import logging
+import time
+
+from bot.clients.redis_client import RedisClient
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+BUCKET_REDIS_KEY = "pyrus:rate_limit:bucket"
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+
+# Приоритет текущей asyncio-задачи: фоновые задачи выставляют его один раз при старте
+request_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "pyrus_request_priority", default=PRIORITY_INTERACTIVE
+)
+
+# Token bucket: возвращает сколько секунд подождать (0 — токен выдан).
+# reserve — сколько токенов не отдавать фоновым запросам, чтобы их всегда хватало пользователям.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens - 1 >= reserve then
+    tokens = tokens - 1
+else
+    wait = (reserve + 1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+def set_background_priority() -> None:
+    """Помечает запросы текущей задачи (и её дочерних задач) как фоновые"""
+    request_priority.set(PRIORITY_BACKGROUND)
+
+
+class RateLimiter:
+    """
+    Общий для всех процессов token bucket в Redis под квоту Pyrus API.
+    Интерактивные запросы пользователей могут тратить весь бакет,
+    фоновые — только то, что выше резерва PYRUS_RATE_BACKGROUND_RESERVE.
+    При недоступности Redis работает такой же локальный бакет.
+    """
+    _script = None
+    _local_tokens: float | None = None
+    _local_ts: float = 0.0
+    _local_lock: asyncio.Lock | None = None
+
+    @classmethod
+    async def acquire(cls) -> None:
+        """Ждёт, пока бакет выдаст токен на один запрос"""
+        reserve = settings.PYRUS_RATE_BACKGROUND_RESERVE if request_priority.get() == PRIORITY_BACKGROUND else 0
+        while True:
+            wait = await cls._take(reserve)
+            if wait <= 0:
+                return
+            logger.debug(f"Pyrus rate limit: waiting {wait:.2f}s ({request_priority.get()})")
+            await asyncio.sleep(wait)
+
+    @classmethod
+    async def _take(cls, reserve: int) -> float:
+        try:
+            redis = await RedisClient.get_instance()
+            if cls._script is None:
+                cls._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+            wait = await cls._script(
+                keys=[BUCKET_REDIS_KEY],
+                args=[settings.PYRUS_RATE_LIMIT_PER_SECOND, settings.PYRUS_RATE_BURST, reserve],
+            )
+            return float(wait)
+        except Exception as e:
+            logger.warning(f"Redis rate limiter unavailable, using local bucket: {e}")
+            return await cls._take_local(reserve)
+
+    @classmethod
+    async def _take_local(cls, reserve: int) -> float:
+        if cls._local_lock is None:
+            cls._local_lock = asyncio.Lock()
+        async with cls._local_lock:
+            rate = settings.PYRUS_RATE_LIMIT_PER_SECOND
+            capacity = settings.PYRUS_RATE_BURST
+            now = time.monotonic()
+            tokens = capacity if cls._local_tokens is None else cls._local_tokens
+            tokens = min(capacity, tokens + (now - cls._local_ts) * rate)
+            cls._local_ts = now
+            if tokens - 1 >= reserve:
+                cls._local_tokens = tokens - 1
+                return 0
+            cls._local_tokens = tokens
+            return (reserve + 1 - tokens) / rate
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from bot.clients.redis_client import RedisClient
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_REDIS_KEY = "pyrus:cache:{name}"
+
+
+class RegisterCache:
+    """
+    Двухуровневый кеш справочников и реестров Pyrus:
+    in-memory LRU/TTL в процессе + общая копия в Redis.
+    Устаревшие данные отдаются сразу, а обновление идёт одной фоновой задачей.
+    """
+    _local: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # name -> (fetched_at, data)
+    _refreshing: Dict[str, asyncio.Task] = {}
+
+    @classmethod
+    async def get(cls, name: str, loader: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """
+        Возвращает данные по имени.
+        - свежие (моложе REGISTER_CACHE_TTL) — сразу;
+        - устаревшие (моложе REGISTER_CACHE_STALE_TTL) — сразу, запуская фоновое обновление;
+        - иначе — ждём загрузку (одну на всех конкурентных вызывающих).
+        """
+        entry = cls._get_local(name)
+        if entry is None:
+            entry = await cls._get_redis(name)
+            if entry is not None:
+                cls._set_local(name, *entry)
+
+        if entry is not None:
+            fetched_at, data = entry
+            age = time.time() - fetched_at
+            if age < settings.REGISTER_CACHE_TTL:
+                return data
+            if age < settings.REGISTER_CACHE_STALE_TTL:
+                cls._schedule_refresh(name, loader)
+                return data
+
+        # shield: отмена одного вызывающего не должна отменять загрузку, которую ждут остальные
+        return await asyncio.shield(cls._schedule_refresh(name, loader))
+
+    @classmethod
+    async def invalidate(cls, name: str) -> None:
+        """Удаляет данные из обоих уровней кеша"""
+        cls._local.pop(name, None)
+        try:
+            redis = await RedisClient.get_instance()
+            await redis.delete(CACHE_REDIS_KEY.format(name=name))
+        except Exception as e:
+            logger.error(f"Error deleting cache {name}: {e}")
+
+    @classmethod
+    def _schedule_refresh(cls, name: str, loader: Callable[[], Awaitable[Optional[Any]]]) -> asyncio.Task:
+        """Запускает обновление, если оно ещё не идёт, и возвращает задачу обновления"""
+        task = cls._refreshing.get(name)
+        if task is None or task.done():
+            task = asyncio.create_task(cls._refresh(name, loader))
+            cls._refreshing[name] = task
+            task.add_done_callback(lambda t: cls._refreshing.pop(name, None) if cls._refreshing.get(name) is t else None)
+        return task
+
+    @classmethod
+    async def _refresh(cls, name: str, loader: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        try:
+            data = await loader()
+        except Exception as e:
+            logger.exception(f"Failed to refresh cache {name}: {e}")
+            data = None
+
+        if data is None:
+            # Не затираем кеш неудачной загрузкой — отдаём то, что есть
+            entry = cls._get_local(name)
+            return entry[1] if entry else None
+
+        fetched_at = time.time()
+        cls._set_local(name, fetched_at, data)
+        await cls._set_redis(name, fetched_at, data)
+        logger.info(f"Cache {name} refreshed")
+        return data
+
+    @classmethod
+    def _get_local(cls, name: str) -> Optional[Tuple[float, Any]]:
+        entry = cls._local.get(name)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= settings.REGISTER_CACHE_STALE_TTL:
+            del cls._local[name]
+            return None
+        cls._local.move_to_end(name)
+        return entry
+
+    @classmethod
+    def _set_local(cls, name: str, fetched_at: float, data: Any) -> None:
+        cls._local[name] = (fetched_at, data)
+        cls._local.move_to_end(name)
+        while len(cls._local) > settings.REGISTER_CACHE_MAX_ENTRIES:
+            cls._local.popitem(last=False)
+
+    @staticmethod
+    async def _get_redis(name: str) -> Optional[Tuple[float, Any]]:
+        try:
+            redis = await RedisClient.get_instance()
+            raw = await redis.get(CACHE_REDIS_KEY.format(name=name))
+            if raw is None:
+                return None
+            payload = json.loads(raw)
+            return payload["fetched_at"], payload["data"]
+        except Exception as e:
+            logger.error(f"Error reading cache {name} from Redis: {e}")
+            return None
+
+    @staticmethod
+    async def _set_redis(name: str, fetched_at: float, data: Any) -> None:
+        try:
+            redis = await RedisClient.get_instance()
+            await redis.set(
+                CACHE_REDIS_KEY.format(name=name),
+                json.dumps({"fetched_at": fetched_at, "data": data}),
+                ex=settings.REGISTER_CACHE_STALE_TTL,
+            )
+        except Exception as e:
+            logger.error(f"Error saving cache {name} to Redis: {e}")
@@ -0,0 +1,71 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RegisterIndex:
+    """
+    Хеш-индекс по значению поля реестра Pyrus: value -> id задачи.
+    Строится один раз и при обновлении реестра пересчитывается только
+    для изменившихся задач (по last_modified_date).
+    """
+
+    def __init__(self, field_code: str):
+        self.field_code = field_code
+        self._source: Optional[List[Dict]] = None  # версия реестра, по которой построен индекс
+        self._index: Dict[Any, Dict[int, None]] = {}  # value -> упорядоченное множество task_id
+        self._tasks: Dict[int, Tuple[Optional[str], Any]] = {}  # task_id -> (last_modified_date, value)
+
+    def lookup(self, tasks: List[Dict], value: Any) -> Optional[int]:
+        """Возвращает id задачи с данным значением поля за O(1)"""
+        if tasks is not self._source:
+            self._sync(tasks)
+        owners = self._index.get(value)
+        return next(iter(owners)) if owners else None
+
+    def _sync(self, tasks: List[Dict]) -> None:
+        """Приводит индекс к новой версии реестра, обрабатывая только изменения"""
+        seen = set()
+        changed = 0
+        for task in tasks:
+            task_id = task.get("id")
+            if task_id is None:
+                continue
+            seen.add(task_id)
+            modified = task.get("last_modified_date")
+            previous = self._tasks.get(task_id)
+            if previous is not None and modified is not None and previous[0] == modified:
+                continue
+
+            value = self._extract_value(task)
+            if previous is not None:
+                self._drop(task_id, previous[1])
+            self._tasks[task_id] = (modified, value)
+            if value is not None:
+                self._index.setdefault(value, {})[task_id] = None
+            changed += 1
+
+        for task_id in set(self._tasks) - seen:
+            _, value = self._tasks.pop(task_id)
+            self._drop(task_id, value)
+            changed += 1
+
+        self._source = tasks
+        logger.debug(f"Index {self.field_code} synced: {changed} changes, {len(self._index)} keys")
+
+    def _extract_value(self, task: Dict) -> Any:
+        for field in task.get("fields", []):
+            if field.get("code") == self.field_code:
+                value = field.get("value")
+                # Нехешируемые значения (каталоги, таблицы) не индексируем
+                return None if isinstance(value, (dict, list)) else value
+        return None
+
+    def _drop(self, task_id: int, value: Any) -> None:
+        owners = self._index.get(value) if value is not None else None
+        if owners is None:
+            return
+        owners.pop(task_id, None)
+        if not owners:
+            del self._index[value]
@@ -0,0 +1,144 @@
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+# Sorted set всех открытых окон переоткрытия: member "{user_id}:{task_id}", score — время истечения (unix)
+EXPIRY_INDEX_KEY = "reopen_windows:expiry"
+# Sorted set окон пользователя: member task_id, score — время истечения (unix)
+USER_WINDOWS_KEY = "reopen_windows:user:{user_id}"
+# Hash данных задач пользователя: task_id -> JSON {"task_id", "fields"}
+USER_PAYLOADS_KEY = "reopen_windows:payloads:{user_id}"
+WINDOW_KEYS_TTL = 3600 + 60  # в секундах
+# Ключи окон прежнего формата — переносятся при старте бота
+LEGACY_KEY_PATTERN = "available_task:*"
+
+
+class ReopenWindows:
+    """
+    Окна переоткрытия закрытых задач.
+    У каждого пользователя — sorted set task_id по времени истечения и hash с данными задач,
+    поэтому экран закрытых задач читается одним пайплайном без KEYS.
+    Общий индекс по времени истечения нужен для метрик планировщика.
+    """
+
+    @staticmethod
+    def _member(user_id: int | str, task_id: int | str) -> str:
+        return f"{user_id}:{task_id}"
+
+    @classmethod
+    async def open(cls, redis: Redis, user_id: int | str, task_id: int | str, expire_at: float, payload: Dict) -> None:
+        """Открывает/продлевает окно переоткрытия задачи"""
+        await cls.open_many(redis, [(user_id, task_id, expire_at, payload)])
+
+    @classmethod
+    async def open_many(cls, redis: Redis, windows: List[Tuple[int | str, int | str, float, Dict]]) -> None:
+        """Открывает/продлевает окна (user_id, task_id, expire_at, payload) одним пайплайном"""
+        if not windows:
+            return
+        async with redis.pipeline(transaction=True) as pipe:
+            for user_id, task_id, expire_at, payload in windows:
+                windows_key = USER_WINDOWS_KEY.format(user_id=user_id)
+                payloads_key = USER_PAYLOADS_KEY.format(user_id=user_id)
+                pipe.zadd(windows_key, {str(task_id): expire_at})
+                pipe.hset(payloads_key, str(task_id), json.dumps(payload))
+                # Окно не длиннее часа, поэтому ключи пользователя переживут любое из его окон
+                pipe.expire(windows_key, WINDOW_KEYS_TTL)
+                pipe.expire(payloads_key, WINDOW_KEYS_TTL)
+                pipe.zadd(EXPIRY_INDEX_KEY, {cls._member(user_id, task_id): expire_at})
+            await pipe.execute()
+
+    @classmethod
+    async def close(cls, redis: Redis, user_id: int | str, task_id: int | str) -> None:
+        """Удаляет окно (задача переоткрыта)"""
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(USER_WINDOWS_KEY.format(user_id=user_id), str(task_id))
+            pipe.hdel(USER_PAYLOADS_KEY.format(user_id=user_id), str(task_id))
+            pipe.zrem(EXPIRY_INDEX_KEY, cls._member(user_id, task_id))
+            await pipe.execute()
+
+    @classmethod
+    async def get_expire_at(cls, redis: Redis, user_id: int | str, task_id: int | str) -> Optional[float]:
+        """Время истечения окна задачи или None"""
+        return (await cls.get_expire_at_many(redis, [(user_id, task_id)]))[0]
+
+    @staticmethod
+    async def get_expire_at_many(redis: Redis, windows: List[Tuple[int | str, int | str]]) -> List[Optional[float]]:
+        """Время истечения окон (user_id, task_id) одним пайплайном, в том же порядке"""
+        if not windows:
+            return []
+        async with redis.pipeline(transaction=False) as pipe:
+            for user_id, task_id in windows:
+                pipe.zscore(USER_WINDOWS_KEY.format(user_id=user_id), str(task_id))
+            return await pipe.execute()
+
+    @staticmethod
+    async def get_user_windows(redis: Redis, user_id: int | str) -> List[Dict]:
+        """
+        Данные задач с открытым окном одним пайплайном.
+        Истёкшие окна удаляются из sorted set, а их данные — из hash (лениво).
+        """
+        windows_key = USER_WINDOWS_KEY.format(user_id=user_id)
+        payloads_key = USER_PAYLOADS_KEY.format(user_id=user_id)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(windows_key, "-inf", time.time())
+            pipe.zrange(windows_key, 0, -1)
+            pipe.hgetall(payloads_key)
+            _, task_ids, payloads = await pipe.execute()
+
+        alive = set(task_ids)
+        expired = [task_id for task_id in payloads if task_id not in alive]
+        if expired:
+            await redis.hdel(payloads_key, *expired)
+
+        tasks = []
+        for task_id in task_ids:
+            raw = payloads.get(task_id)
+            if raw is None:
+                continue
+            tasks.append(json.loads(raw))
+        return tasks
+
+    @staticmethod
+    async def gauges(redis: Redis) -> Tuple[int, Optional[float]]:
+        """
+        Возвращает (число открытых окон, секунд до ближайшего истечения).
+        Истёкшие окна удаляются из индекса тем же запросом.
+        """
+        now = time.time()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(EXPIRY_INDEX_KEY, "-inf", now)
+            pipe.zcard(EXPIRY_INDEX_KEY)
+            pipe.zrange(EXPIRY_INDEX_KEY, 0, 0, withscores=True)
+            _, count, nearest = await pipe.execute()
+        nearest_in = nearest[0][1] - now if nearest else None
+        return count, nearest_in
+
+    @classmethod
+    async def migrate_legacy(cls, redis: Redis) -> int:
+        """
+        Переносит окна из ключей прежнего формата available_task:{user_id}:{task_id}
+        (JSON {"task_id", "fields"} с TTL до конца окна) в индекс и удаляет их.
+        Безопасно запускать одновременно из нескольких реплик. Возвращает число перенесённых окон.
+        """
+        migrated = 0
+        async for key in redis.scan_iter(match=LEGACY_KEY_PATTERN, count=1000):
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                raw, ttl_ms = await pipe.execute()
+            try:
+                _, user_id, task_id = key.split(":")
+                if raw is not None and ttl_ms > 0:
+                    await cls.open(redis, user_id, task_id, time.time() + ttl_ms / 1000, json.loads(raw))
+                    migrated += 1
+            except Exception as e:
+                logger.error(f"Не удалось перенести окно переоткрытия {key}: {e}")
+            await redis.delete(key)
+        if migrated:
+            logger.info(f"Перенесено окон переоткрытия из ключей available_task:*: {migrated}")
+        return migrated
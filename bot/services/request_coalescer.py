@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+
+from bot.clients.redis_client import RedisClient
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+LEASE_REDIS_KEY = "pyrus:inflight:lease:{key}"
+RESULT_REDIS_KEY = "pyrus:inflight:result:{key}:{token}"
+_POLL_INTERVAL = 0.05  # секунд между проверками результата чужого запроса
+
+
+class RequestCoalescer:
+    """
+    Объединение одинаковых конкурентных запросов (single-flight).
+    В процессе вызывающие с одним ключом ждут один общий future.
+    Опционально (PYRUS_COALESCE_REDIS) — между процессами через короткую аренду в Redis:
+    запрос выполняет владелец аренды, остальные забирают его результат.
+    """
+    _inflight: Dict[str, asyncio.Task] = {}
+    stats: Dict[str, int] = {
+        "executed": 0,  # реально выполненные запросы
+        "coalesced_local": 0,  # присоединились к запросу в этом процессе
+        "coalesced_redis": 0,  # получили результат запроса другого процесса
+    }
+
+    @classmethod
+    async def run(cls, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет func один раз на все одновременные вызовы с одинаковым key"""
+        task = cls._inflight.get(key)
+        if task is not None and not task.done():
+            cls.stats["coalesced_local"] += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.create_task(cls._execute(key, func))
+        cls._inflight[key] = task
+        task.add_done_callback(lambda t: cls._inflight.pop(key, None) if cls._inflight.get(key) is t else None)
+        return await asyncio.shield(task)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, int]:
+        return dict(cls.stats)
+
+    @classmethod
+    async def _execute(cls, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        if not settings.PYRUS_COALESCE_REDIS:
+            cls.stats["executed"] += 1
+            return await func()
+
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        lease_key = LEASE_REDIS_KEY.format(key=digest)
+        lease_ttl = settings.PYRUS_COALESCE_LEASE_SECONDS
+        # Результат привязан к токену аренды: ожидающие не получат результат прошлого раунда
+        token = uuid.uuid4().hex
+
+        try:
+            redis = await RedisClient.get_instance()
+            is_owner = await redis.set(lease_key, token, nx=True, ex=lease_ttl)
+        except Exception as e:
+            logger.error(f"Coalescing lease error, executing locally: {e}")
+            cls.stats["executed"] += 1
+            return await func()
+
+        if not is_owner:
+            # Ждём результат владельца аренды, пока она жива
+            try:
+                owner_token = await redis.get(lease_key)
+                while owner_token is not None:
+                    raw = await redis.get(RESULT_REDIS_KEY.format(key=digest, token=owner_token))
+                    if raw is not None:
+                        cls.stats["coalesced_redis"] += 1
+                        return json.loads(raw)
+                    if await redis.get(lease_key) != owner_token:
+                        # Аренду сняли — результат мог появиться перед этим
+                        raw = await redis.get(RESULT_REDIS_KEY.format(key=digest, token=owner_token))
+                        if raw is not None:
+                            cls.stats["coalesced_redis"] += 1
+                            return json.loads(raw)
+                        break
+                    await asyncio.sleep(_POLL_INTERVAL)
+            except Exception as e:
+                logger.error(f"Error waiting for coalesced result, executing locally: {e}")
+
+        cls.stats["executed"] += 1
+        result = await func()
+        if is_owner:
+            try:
+                if result is not None:
+                    await redis.set(RESULT_REDIS_KEY.format(key=digest, token=token), json.dumps(result), ex=lease_ttl)
+                await redis.delete(lease_key)
+            except Exception as e:
+                logger.error(f"Error publishing coalesced result: {e}")
+        return result
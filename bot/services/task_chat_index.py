@@ -0,0 +1,46 @@
+import logging
+from typing import Dict, Optional
+
+from bot.clients.redis_client import RedisClient
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+TASK_CHAT_KEY = "task_chat:{task_id}"
+
+
+class TaskChatIndex:
+    """
+    Индекс задача Pyrus -> chat_id Telegram её автора.
+    Пишется при создании задачи ботом и обновляется из событий вебхука,
+    поэтому получатель события находится одним GET без разбора полей задачи.
+    """
+    stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0}
+
+    @classmethod
+    async def get(cls, task_id: int | str) -> Optional[int]:
+        """chat_id автора задачи; срок хранения продлевается при каждом обращении"""
+        try:
+            redis = await RedisClient.get_instance()
+            raw = await redis.getex(TASK_CHAT_KEY.format(task_id=task_id), ex=settings.TASK_CHAT_INDEX_TTL)
+            chat_id = int(raw) if raw else None
+        except Exception as e:
+            logger.error(f"Error reading task chat index for task {task_id}: {e}")
+            return None
+        cls.stats["hits" if chat_id else "misses"] += 1
+        return chat_id
+
+    @classmethod
+    async def set(cls, task_id: int | str, chat_id: int | str) -> None:
+        """Запоминает chat_id автора задачи на TASK_CHAT_INDEX_TTL"""
+        try:
+            redis = await RedisClient.get_instance()
+            await redis.set(TASK_CHAT_KEY.format(task_id=task_id), chat_id, ex=settings.TASK_CHAT_INDEX_TTL)
+            cls.stats["writes"] += 1
+        except Exception as e:
+            logger.error(f"Error saving task chat index for task {task_id}: {e}")
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, float]:
+        lookups = cls.stats["hits"] + cls.stats["misses"]
+        return {**cls.stats, "hit_rate": cls.stats["hits"] / lookups if lookups else 0.0}
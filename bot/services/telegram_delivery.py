@@ -0,0 +1,306 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Dict, Optional, Set
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from redis.asyncio import Redis
+
+from bot.clients.bot_client import BotClient
+from bot.clients.redis_client import RedisClient
+from bot.services.rate_limiter import TOKEN_BUCKET_SCRIPT
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Sorted set сообщений к отправке: member — id сообщения, score — когда отправлять (unix)
+QUEUE_KEY = "telegram:delivery:queue"
+# Hash сообщений: id -> JSON {"chat_id", "text", "reply_markup", "enqueued_at", "attempt"}
+PAYLOADS_KEY = "telegram:delivery:payloads"
+BUCKET_KEY = "telegram:delivery:bucket"
+# Чат занят: в него идёт отправка или не истёк интервал после предыдущего сообщения
+CHAT_PACE_KEY = "telegram:delivery:chat:{chat_id}"
+# Пауза всех отправок после RetryAfter от Telegram
+PAUSE_KEY = "telegram:delivery:pause"
+# Счётчики доставки, общие для всех процессов: отправители и /webhook/backlog видят одни значения
+STATS_KEY = "telegram:delivery:stats"
+_STATS_FIELDS = ("enqueued", "sent", "failed", "retry_after", "latency_total", "latency_max")
+
+# Забирает сообщение, если срок его отправки наступил и чат свободен: занимает чат и сдвигает
+# сообщение на CLAIM_TIMEOUT вперёд, чтобы при падении отправителя оно вернулось в очередь, а не потерялось.
+# Пока чат занят, его следующие сообщения не забираются — в чат они уходят по одному и по порядку
+_CLAIM_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score and tonumber(score) <= tonumber(ARGV[2])
+        and redis.call('SET', KEYS[2], '1', 'NX', 'PX', ARGV[4]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Снимает сообщение с очереди, освобождает чат через TELEGRAM_CHAT_INTERVAL и учитывает результат:
+# latency_total — суммарное время от постановки до отправки, секунд
+_FINISH_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('SET', KEYS[4], '1', 'PX', ARGV[4])
+if ARGV[2] == '0' then
+    redis.call('HINCRBY', KEYS[3], 'failed', 1)
+    return 0
+end
+redis.call('HINCRBY', KEYS[3], 'sent', 1)
+redis.call('HINCRBYFLOAT', KEYS[3], 'latency_total', ARGV[3])
+local latency_max = tonumber(redis.call('HGET', KEYS[3], 'latency_max') or '0')
+if tonumber(ARGV[3]) > latency_max then
+    redis.call('HSET', KEYS[3], 'latency_max', ARGV[3])
+end
+return 1
+"""
+
+
+class TelegramDelivery:
+    """
+    Очередь исходящих сообщений Telegram в Redis.
+    - общий для всех процессов token bucket TELEGRAM_GLOBAL_RATE сообщений в секунду;
+    - в один чат — по одному сообщению в порядке постановки и не чаще раза в TELEGRAM_CHAT_INTERVAL секунд;
+    - RetryAfter от Telegram приостанавливает все отправки на указанное время;
+    - сообщения хранятся в Redis до подтверждённой отправки и переживают перезапуск.
+    """
+    _claim_script = None
+    _finish_script = None
+    # Сколько страниц по TELEGRAM_DELIVERY_BATCH сообщений просматривать за проход
+    _SCAN_PAGES = 10
+    _bucket_script = None
+    # Ссылки на отправки в процессе, чтобы задачи не собрал GC
+    _deliveries: Set[asyncio.Task] = set()
+
+    @classmethod
+    async def enqueue(cls, chat_id: int, text: str,
+                      reply_markup: Optional[InlineKeyboardMarkup] = None) -> str:
+        """Ставит сообщение в очередь отправки"""
+        now = time.time()
+        # Время в id сохраняет порядок сообщений одного чата при равных score
+        item_id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        item = {
+            "chat_id": chat_id,
+            "text": text,
+            "reply_markup": reply_markup.model_dump(mode="json", exclude_none=True) if reply_markup else None,
+            "enqueued_at": now,
+            "attempt": 0,
+        }
+        redis = await RedisClient.get_instance()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(PAYLOADS_KEY, item_id, json.dumps(item, ensure_ascii=False))
+            pipe.zadd(QUEUE_KEY, {item_id: now})
+            pipe.hincrby(STATS_KEY, "enqueued", 1)
+            await pipe.execute()
+        return item_id
+
+    @classmethod
+    async def get_metrics(cls, redis: Redis) -> Dict[str, float]:
+        """Размер очереди и задержка доставки"""
+        now = time.time()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(QUEUE_KEY)
+            pipe.zcount(QUEUE_KEY, "-inf", now)
+            pipe.zrange(QUEUE_KEY, 0, 0, withscores=True)
+            pipe.hgetall(STATS_KEY)
+            backlog, due, oldest, raw_stats = await pipe.execute()
+        stats = {field: float(raw_stats.get(field, 0)) for field in _STATS_FIELDS}
+        sent = stats["sent"]
+        return {
+            "backlog": backlog,
+            "due": due,
+            "oldest_due_for": max(0.0, now - oldest[0][1]) if oldest else 0.0,
+            "latency_avg": stats["latency_total"] / sent if sent else 0.0,
+            **stats,
+        }
+
+    @classmethod
+    async def run(cls) -> None:
+        """Фоновая задача отправки: можно запускать в нескольких процессах одновременно"""
+        redis = await RedisClient.get_instance()
+        slots = asyncio.Semaphore(settings.TELEGRAM_DELIVERY_CONCURRENCY)
+        if cls._claim_script is None:
+            cls._claim_script = redis.register_script(_CLAIM_SCRIPT)
+        last_report = time.monotonic()
+        while True:
+            try:
+                pause_ms = await redis.pttl(PAUSE_KEY)
+                if pause_ms > 0:
+                    await asyncio.sleep(pause_ms / 1000)
+                    continue
+
+                dispatched = await cls._dispatch_due(redis, slots)
+
+                if time.monotonic() - last_report >= 60:
+                    last_report = time.monotonic()
+                    metrics = await cls.get_metrics(redis)
+                    logger.info(
+                        f"Доставка Telegram: в очереди {metrics['backlog']} (к отправке {metrics['due']}), "
+                        f"отправлено {metrics['sent']:.0f}, ошибок {metrics['failed']:.0f}, "
+                        f"задержка средняя {metrics['latency_avg']:.2f}с / максимальная {metrics['latency_max']:.2f}с"
+                    )
+                if not dispatched:
+                    await asyncio.sleep(settings.TELEGRAM_DELIVERY_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Ошибка цикла доставки Telegram: {e}")
+                await asyncio.sleep(1)
+
+    @classmethod
+    async def _dispatch_due(cls, redis: Redis, slots: asyncio.Semaphore) -> int:
+        """
+        Забирает и запускает отправку сообщений, срок которых наступил, — от каждого свободного чата
+        только самое раннее. Просматривает до _SCAN_PAGES страниц очереди, чтобы длинная очередь
+        одного чата не задерживала остальные. Возвращает число запущенных отправок.
+        """
+        now = time.time()
+        claim_until = now + settings.TELEGRAM_DELIVERY_CLAIM_TIMEOUT
+        claim_ms = settings.TELEGRAM_DELIVERY_CLAIM_TIMEOUT * 1000
+        seen_chats = set()
+        dispatched = 0
+        for page in range(cls._SCAN_PAGES):
+            due = await redis.zrangebyscore(
+                QUEUE_KEY, "-inf", now,
+                start=page * settings.TELEGRAM_DELIVERY_BATCH, num=settings.TELEGRAM_DELIVERY_BATCH,
+            )
+            if not due:
+                break
+            payloads = await redis.hmget(PAYLOADS_KEY, due)
+            for item_id, raw in zip(due, payloads):
+                if raw is None:
+                    await redis.zrem(QUEUE_KEY, item_id)
+                    continue
+                chat_id = json.loads(raw)["chat_id"]
+                # Сообщения в очереди идут по порядку постановки: первое сообщение чата — его голова
+                if chat_id in seen_chats:
+                    continue
+                seen_chats.add(chat_id)
+                claimed = await cls._claim_script(
+                    keys=[QUEUE_KEY, CHAT_PACE_KEY.format(chat_id=chat_id)],
+                    args=[item_id, now, claim_until, claim_ms],
+                )
+                if not claimed:  # чат занят или сообщение забрал другой процесс
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(cls._deliver(redis, item_id))
+                cls._deliveries.add(task)
+                task.add_done_callback(cls._deliveries.discard)
+                task.add_done_callback(lambda _: slots.release())
+                dispatched += 1
+                if dispatched >= settings.TELEGRAM_DELIVERY_BATCH:
+                    return dispatched
+        return dispatched
+
+    @classmethod
+    async def _deliver(cls, redis: Redis, item_id: str) -> None:
+        try:
+            await cls._deliver_item(redis, item_id)
+        except Exception as e:
+            # Сообщение остаётся захваченным и вернётся в очередь по истечении TELEGRAM_DELIVERY_CLAIM_TIMEOUT
+            logger.exception(f"Ошибка доставки сообщения {item_id}: {e}")
+
+    @classmethod
+    async def _deliver_item(cls, redis: Redis, item_id: str) -> None:
+        raw = await redis.hget(PAYLOADS_KEY, item_id)
+        if raw is None:
+            await redis.zrem(QUEUE_KEY, item_id)
+            return
+        item = json.loads(raw)
+        chat_id = item["chat_id"]
+        pace_key = CHAT_PACE_KEY.format(chat_id=chat_id)
+
+        await cls._acquire_global(redis)
+        await cls._wait_pause(redis, item_id, pace_key)
+        # Продлеваем захват перед самой отправкой: ожидание бакета не съедает время на запрос к Telegram
+        await cls._extend_claim(redis, item_id, pace_key, settings.TELEGRAM_DELIVERY_CLAIM_TIMEOUT)
+        try:
+            reply_markup = item.get("reply_markup")
+            await BotClient.get_instance().send_message(
+                chat_id=chat_id,
+                text=item["text"],
+                reply_markup=InlineKeyboardMarkup.model_validate(reply_markup) if reply_markup else None,
+            )
+        except TelegramRetryAfter as e:
+            await redis.hincrby(STATS_KEY, "retry_after", 1)
+            logger.warning(f"Telegram RetryAfter {e.retry_after}s, отправки приостановлены")
+            await redis.set(PAUSE_KEY, "1", px=int(e.retry_after * 1000))
+            await cls._release(redis, item_id, item, pace_key, e.retry_after)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или сообщение некорректно — повтор не поможет
+            logger.error(f"Сообщение {item_id} в чат {chat_id} не доставлено: {e}")
+            await cls._finish(redis, item_id, item, sent=False)
+            return
+        except Exception as e:
+            item["attempt"] += 1
+            if item["attempt"] >= settings.TELEGRAM_DELIVERY_MAX_ATTEMPTS:
+                logger.error(f"Сообщение {item_id} в чат {chat_id} не доставлено за {item['attempt']} попыток: {e}")
+                await cls._finish(redis, item_id, item, sent=False)
+                return
+            logger.warning(f"Ошибка отправки сообщения {item_id} в чат {chat_id}, попытка {item['attempt']}: {e}")
+            await cls._release(redis, item_id, item, pace_key, 2 ** item["attempt"])
+            return
+
+        await cls._finish(redis, item_id, item, sent=True)
+
+    @staticmethod
+    async def _release(redis: Redis, item_id: str, item: Dict, pace_key: str, delay: float) -> None:
+        """
+        Возвращает сообщение в очередь для повтора через delay секунд. Сообщение остаётся на своём месте
+        (score — время постановки), а чат держится занятым на время delay: более поздние сообщения
+        этого чата не обгонят повторяемое.
+        """
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(PAYLOADS_KEY, item_id, json.dumps(item, ensure_ascii=False))
+            pipe.zadd(QUEUE_KEY, {item_id: item["enqueued_at"]})
+            pipe.set(pace_key, "1", px=max(int(delay * 1000), 1))
+            await pipe.execute()
+
+    @staticmethod
+    async def _extend_claim(redis: Redis, item_id: str, pace_key: str, seconds: float) -> None:
+        """Продлевает захват сообщения и занятость его чата на seconds секунд"""
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(QUEUE_KEY, {item_id: time.time() + seconds}, xx=True)
+            pipe.pexpire(pace_key, int(seconds * 1000))
+            await pipe.execute()
+
+    @classmethod
+    async def _finish(cls, redis: Redis, item_id: str, item: Dict, sent: bool) -> None:
+        if cls._finish_script is None:
+            cls._finish_script = redis.register_script(_FINISH_SCRIPT)
+        latency = time.time() - item["enqueued_at"]
+        await cls._finish_script(
+            keys=[QUEUE_KEY, PAYLOADS_KEY, STATS_KEY, CHAT_PACE_KEY.format(chat_id=item["chat_id"])],
+            args=[item_id, 1 if sent else 0, latency, int(settings.TELEGRAM_CHAT_INTERVAL * 1000)],
+        )
+
+    @classmethod
+    async def _wait_pause(cls, redis: Redis, item_id: str, pace_key: str) -> None:
+        """
+        Ждёт окончания паузы после RetryAfter — её мог выставить любой процесс, пока сообщение ждало бакет.
+        Захват сообщения продлевается на время паузы, чтобы его не забрал другой процесс.
+        """
+        while (pause_ms := await redis.pttl(PAUSE_KEY)) > 0:
+            await cls._extend_claim(redis, item_id, pace_key, pause_ms / 1000 + settings.TELEGRAM_DELIVERY_CLAIM_TIMEOUT)
+            await asyncio.sleep(pause_ms / 1000)
+
+    @classmethod
+    async def _acquire_global(cls, redis: Redis) -> None:
+        """Ждёт токен общего бакета отправок"""
+        if cls._bucket_script is None:
+            cls._bucket_script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        while True:
+            wait = float(await cls._bucket_script(
+                keys=[BUCKET_KEY],
+                args=[settings.TELEGRAM_GLOBAL_RATE, settings.TELEGRAM_GLOBAL_BURST, 0],
+            ))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_Job = Tuple[Callable[[], Awaitable[Optional[Any]]], asyncio.Future, float]
+
+
+class UploadScheduler:
+    """
+    Общий для процесса планировщик загрузок файлов.
+    - не больше UPLOAD_GLOBAL_CONCURRENCY загрузок одновременно;
+    - не больше UPLOAD_PER_USER_CONCURRENCY загрузок одного пользователя;
+    - очереди пользователей обслуживаются по кругу, чтобы один пользователь
+      с большим количеством файлов не задерживал остальных;
+    - неудачная загрузка (исключение или None) повторяется UPLOAD_RETRY_ATTEMPTS раз.
+    """
+    _queues: "OrderedDict[int, Deque[_Job]]" = OrderedDict()
+    _active: Dict[int, int] = {}
+    _active_total: int = 0
+    stats: Dict[str, float] = {
+        "submitted": 0,
+        "completed": 0,
+        "failed": 0,
+        "retries": 0,
+        "wait_time_total": 0.0,  # суммарное ожидание в очереди, секунд
+        "wait_time_max": 0.0,
+    }
+
+    @classmethod
+    async def submit(cls, user_id: int, func: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """Ставит загрузку в очередь пользователя и ждёт её результат (None — если все попытки неудачны)"""
+        future = asyncio.get_running_loop().create_future()
+        cls._queues.setdefault(user_id, deque()).append((func, future, time.monotonic()))
+        cls.stats["submitted"] += 1
+        cls._dispatch()
+        return await future
+
+    @classmethod
+    def get_metrics(cls) -> Dict[str, float]:
+        """Глубина очереди, число активных загрузок и время ожидания"""
+        started = cls.stats["completed"] + cls.stats["failed"]
+        return {
+            "queue_depth": sum(len(queue) for queue in cls._queues.values()),
+            "active": cls._active_total,
+            "wait_time_avg": cls.stats["wait_time_total"] / started if started else 0.0,
+            **cls.stats,
+        }
+
+    @classmethod
+    def _dispatch(cls) -> None:
+        """Запускает ожидающие загрузки, пока есть свободные слоты"""
+        while cls._active_total < settings.UPLOAD_GLOBAL_CONCURRENCY:
+            user_id = next(
+                (uid for uid in cls._queues if cls._active.get(uid, 0) < settings.UPLOAD_PER_USER_CONCURRENCY),
+                None,
+            )
+            if user_id is None:
+                return
+
+            queue = cls._queues[user_id]
+            func, future, enqueued_at = queue.popleft()
+            if queue:
+                # Пользователь уходит в конец круга
+                cls._queues.move_to_end(user_id)
+            else:
+                del cls._queues[user_id]
+
+            if future.done():  # вызывающий уже отменил ожидание
+                continue
+
+            cls._active[user_id] = cls._active.get(user_id, 0) + 1
+            cls._active_total += 1
+            asyncio.create_task(cls._run(user_id, func, future, enqueued_at))
+
+    @classmethod
+    async def _run(cls, user_id: int, func: Callable[[], Awaitable[Optional[Any]]],
+                   future: asyncio.Future, enqueued_at: float) -> None:
+        wait_time = time.monotonic() - enqueued_at
+        cls.stats["wait_time_total"] += wait_time
+        cls.stats["wait_time_max"] = max(cls.stats["wait_time_max"], wait_time)
+
+        result = None
+        try:
+            for attempt in range(1, settings.UPLOAD_RETRY_ATTEMPTS + 1):
+                try:
+                    result = await func()
+                except Exception as e:
+                    logger.error(f"Upload attempt {attempt} for user {user_id} failed: {e}")
+                    result = None
+                if result is not None or attempt == settings.UPLOAD_RETRY_ATTEMPTS:
+                    break
+                cls.stats["retries"] += 1
+                await asyncio.sleep(settings.UPLOAD_RETRY_DELAY * attempt)
+        finally:
+            cls.stats["completed" if result is not None else "failed"] += 1
+            if not future.done():
+                future.set_result(result)
+            cls._active[user_id] -= 1
+            if not cls._active[user_id]:
+                del cls._active[user_id]
+            cls._active_total -= 1
+            cls._dispatch()
@@ -1,10 +1,10 @@
-import json
 import logging
 import re
 from aiogram.fsm.context import FSMContext
-from typing import List, Dict, Optional
+from typing import Dict, Optional
 
 from bot.clients.redis_client import RedisClient
+from bot.services.reopen_windows import ReopenWindows
 
 logger = logging.getLogger(__name__)
 
@@ -19,23 +19,6 @@ class TaskUtils:
         description = next((f.get("value") for f in fields if f.get("id") == 2), "Не указано")
         return problem, description
 
-    @classmethod
-    def filter_tasks_by_username(cls, tasks: List[Dict], user_id: int) -> List[Dict]:
-        """Фильтрация задач по Telegram username."""
-        if not user_id:
-            return []
-
-        user_id = str(user_id)
-
-        return [
-            task for task in tasks
-            if any(
-                field.get("code") == "id_user" and
-                str(field.get("value", "")) == user_id
-                for field in task.get("fields", [])
-            )
-        ]
-
     @classmethod
     def extract_data_from_callback(cls, callback_data: str) -> Optional[int]:
         """
@@ -75,33 +58,7 @@ class TaskUtils:
         data = await state.get_data()
         return data.get("task_id")
 
-    @staticmethod
-    def is_data_verification(tasks: list[dict], data: str) -> int | None:
-        """Находит ID задачи по значению поля 'Dadata Inn'"""
-        for task in tasks:
-            for field in task.get("fields", []):
-                if field.get("code") == "Dadata Inn" and field.get("value") == data:
-                    return task.get("id")
-        return None
-
-    @staticmethod
-    def find_user_id(tasks: list[dict], user_id: str) -> str | None:
-        for task in tasks:
-            for field in task.get("fields", []):
-                if field.get("code") == "user_id" and field.get("value") == user_id:
-                    return task.get("id")
-        return None
-
     @staticmethod
     async def get_tasks_for_user(user_id: int):
-        pattern = f"available_task:{user_id}:*"
         redis_client = await RedisClient.get_instance()
-        keys = await redis_client.keys(pattern)
-        tasks = []
-        for key in keys:
-            raw = await redis_client.get(key)
-            if raw is None:
-                continue
-            task_data = json.loads(raw)
-            tasks.append(task_data)
-        return tasks
+        return await ReopenWindows.get_user_windows(redis_client, user_id)
@@ -31,6 +31,66 @@ class Settings(BaseSettings):
         9: "whatsapp",
 }
     VALUE_ID: int
+    # Пул HTTP-соединений к Pyrus
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 30
+    HTTP_DNS_CACHE_TTL: int = 300  # в секундах
+    HTTP_KEEPALIVE_TIMEOUT: int = 60  # в секундах
+    HTTP_REQUEST_TIMEOUT: int = 30  # в секундах
+    # Кеш справочников и реестров Pyrus
+    REGISTER_CACHE_TTL: int = 300  # в секундах, после — отдаём устаревшее и обновляем в фоне
+    REGISTER_CACHE_STALE_TTL: int = 86400  # в секундах, после — ждём свежую загрузку
+    REGISTER_CACHE_MAX_ENTRIES: int = 32
+    # Объединение одинаковых GET-запросов к Pyrus между процессами через Redis
+    PYRUS_COALESCE_REDIS: bool = False
+    PYRUS_COALESCE_LEASE_SECONDS: int = 5
+    # Токен Pyrus
+    PYRUS_TOKEN_TTL: int = 3600  # в секундах, если Pyrus не вернул expires_in
+    PYRUS_TOKEN_REFRESH_MARGIN: int = 300  # в секундах до истечения
+    # Ограничение частоты запросов к Pyrus (общий бакет в Redis) и повторы
+    PYRUS_RATE_LIMIT_PER_SECOND: float = 8.0
+    PYRUS_RATE_BURST: int = 20
+    PYRUS_RATE_BACKGROUND_RESERVE: int = 5  # токенов, недоступных фоновым задачам
+    PYRUS_RETRY_ATTEMPTS: int = 4
+    PYRUS_RETRY_AFTER_MAX: int = 10  # в секундах; с большим Retry-After запрос сразу завершается ошибкой
+    # Размер куска при потоковой передаче файлов Telegram -> Pyrus
+    FILE_STREAM_CHUNK_SIZE: int = 64 * 1024  # в байтах
+    # Планировщик загрузок файлов
+    UPLOAD_GLOBAL_CONCURRENCY: int = 10
+    UPLOAD_PER_USER_CONCURRENCY: int = 3
+    UPLOAD_RETRY_ATTEMPTS: int = 3
+    UPLOAD_RETRY_DELAY: float = 1.0  # в секундах, растёт с номером попытки
+    FILE_GUID_CACHE_TTL: int = 7 * 24 * 3600  # в секундах, сколько помнить guid загруженного файла
+    # Сверка закрытых задач опросом (основной путь — вебхук)
+    CLOSED_TASKS_RECONCILE_INTERVAL: int = 300  # в секундах
+    CLOSED_TASKS_BATCH_SIZE: int = 200
+    CLOSED_TASKS_NOTIFY_CONCURRENCY: int = 10  # одновременных сообщений о завершении
+    # Выбор ведущей реплики для фоновых задач
+    LEADER_LEASE_SECONDS: int = 15  # за это время другая реплика подхватит работу упавшей
+    LEADER_RENEW_INTERVAL: int = 5  # в секундах, должно быть заметно меньше срока аренды
+    # Поток событий вебхука (Redis Streams) и его потребители
+    WEBHOOK_STREAM_MAXLEN: int = 100_000
+    WEBHOOK_PARTITIONS: int = 16  # задач, обрабатываемых одним процессом воркера параллельно
+    WEBHOOK_STREAM_BATCH: int = 10
+    WEBHOOK_CLAIM_INTERVAL: int = 30  # в секундах, как часто забирать зависшие события
+    WEBHOOK_CLAIM_MIN_IDLE_MS: int = 60_000  # событие считается зависшим после этого простоя
+    WEBHOOK_MAX_DELIVERIES: int = 5
+    WEBHOOK_DEDUP_LOCAL_SIZE: int = 10_000  # событий в локальном LRU дедупликации
+    COMMENT_WATERMARK_TTL: int = 90 * 24 * 3600  # в секундах, продлевается при каждом событии задачи
+    # Очередь исходящих сообщений Telegram
+    TELEGRAM_GLOBAL_RATE: float = 30.0  # сообщений в секунду на бота
+    TELEGRAM_GLOBAL_BURST: int = 30
+    TELEGRAM_CHAT_INTERVAL: float = 1.0  # в секундах между сообщениями в один чат
+    TELEGRAM_DELIVERY_CONCURRENCY: int = 10
+    TELEGRAM_DELIVERY_BATCH: int = 50
+    TELEGRAM_DELIVERY_POLL_INTERVAL: float = 0.2  # в секундах, когда очередь пуста
+    # в секундах, после — сообщение возвращается в очередь; больше таймаута сессии бота (60) с запасом на бакет
+    TELEGRAM_DELIVERY_CLAIM_TIMEOUT: int = 120
+    TELEGRAM_DELIVERY_MAX_ATTEMPTS: int = 5
+    # Индекс задача -> chat_id для событий вебхука
+    TASK_CHAT_INDEX_TTL: int = 90 * 24 * 3600  # в секундах, продлевается при каждом событии задачи
+    # Периодический лог метрик процесса бота: загрузки файлов, объединение запросов, кеш guid
+    METRICS_LOG_INTERVAL: int = 60  # в секундах
 
     @property
     def MAX_FILE_SIZE_MB(self) -> int:
@@ -2,19 +2,35 @@ import hashlib
 import json
 import os
 import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import Optional, List, Dict, Any, Coroutine
-from fastapi import FastAPI, Request, Header, HTTPException, BackgroundTasks, status
+from fastapi import FastAPI, Request, Header, HTTPException, status
+from bot.clients.http_client import HttpClient
 from bot.clients.redis_client import RedisClient
+from bot.services.leader_election import LeaderElection
+from bot.services.telegram_delivery import TelegramDelivery
 from config import settings
-from webhook.get_user_id import get_cache, find_user_id, save_cache
-from webhook.process_event import process_event
+from webhook.process_event import process_event, get_stream_backlog
 from redis.exceptions import RedisError
 from fastapi.responses import JSONResponse
 
 from webhook.signature_verification import verify_signature
 
 logging.basicConfig(level=logging.INFO)
-app = FastAPI(title="Pyrus Webhook (FastAPI + Redis idempotency)")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общий пул HTTP-соединений на всё время жизни процесса
+    await HttpClient.get_instance()
+    yield
+    await HttpClient.close()
+    await RedisClient.close()
+
+
+app = FastAPI(title="Pyrus Webhook (FastAPI + Redis idempotency)", lifespan=lifespan)
 IDEPT_TTL = settings.PYRUS_IDEMPOTENT_TTL
 
 
@@ -22,9 +38,21 @@ if not settings.WEBHOOK_SECURITY_KEY:
     logging.warning("PYRUS_BOT_SECRET is not set — signature verification will fail.")
 
 
-# --- Простая in-memory TTL-кеш для idempotency (per-process). Для продакшна — используйте Redis. ---
-_IDEMPOTENT_TTL = 60 * 60  # seconds to remember processed events
-_processed_events: Dict[str, float] = {}  # event_key -> timestamp when processed
+# --- Дедупликация доставок: локальный LRU (per-process) + общий слой в Redis (SET NX EX) ---
+_processed_events: "OrderedDict[str, float]" = OrderedDict()  # event_key -> timestamp when accepted
+dedup_stats: Dict[str, int] = {
+    "accepted": 0,
+    "duplicates_local": 0,  # отброшено по локальному LRU, без запроса к Redis
+    "duplicates_redis": 0,  # отброшено по ключу в Redis (доставка пришла в другой процесс)
+    "duplicates_retry": 0,  # из отброшенных — повторы с заголовком X-Pyrus-Retry
+}
+
+
+def event_identity(data: Dict[str, Any]) -> str:
+    """Стабильный идентификатор события: задача, тип события и последний комментарий"""
+    comments = (data.get("task") or {}).get("comments") or []
+    last_comment_id = comments[-1].get("id") if comments else None
+    return f"{data.get('task_id')}:{data.get('event')}:{last_comment_id}"
 
 
 # --- Helper: create safe redis key (hashing) ---
@@ -33,69 +61,59 @@ def make_event_key(event_key: str) -> str:
     h = hashlib.sha256(event_key.encode("utf-8")).hexdigest()
     return f"pyrus:event:{h}"
 
-# --- Idempotency using Redis SET NX EX ---
-async def remember_event_redis(event_key: str, ttl: int = IDEPT_TTL) -> bool:
-    """
-    Возвращает True если событие новое (и сохранено в Redis), False если уже существовал.
-    Если Redis не доступен — выбрасывает RedisError.
-    """
-    r = await RedisClient.get_instance()
-    if not r:
-        raise RedisError("Redis client not initialized")
 
-    redis_key = make_event_key(event_key)
-    # set NX EX - atomic
-    # redis.set returns True if key was set, None if not set (already exists)
-    try:
-        was_set = await r.set(redis_key, b"1", nx=True, ex=ttl)
-        return bool(was_set)
-    except Exception as exc:
-        # пробросим как RedisError для внешней обработки
-        raise RedisError(str(exc))
-
-# wrapper that tries Redis then fallback
-async def remember_event(event_key: str, ttl: int = IDEPT_TTL) -> Optional[bool]:
-    """
-    Возвращает:
-      - True -> событие новое (ключ успешно установлен в Redis)
-      - False -> событие уже было (ключ уже есть)
-      - None -> Redis недоступен / ошибка — вызывающий должен решить, что делать
-    """
-    try:
-        redis_client = await RedisClient.get_instance()
-    except Exception as exc:
-        logging.exception("Failed to get Redis client instance")
-        return None
+def seen_locally(event_key: str) -> bool:
+    accepted_at = _processed_events.get(event_key)
+    if accepted_at is None:
+        return False
+    if time.time() - accepted_at > IDEPT_TTL:
+        del _processed_events[event_key]
+        return False
+    _processed_events.move_to_end(event_key)
+    return True
 
-    if redis_client is None:
-        logging.warning("Redis singleton returned None")
-        return None
 
-    try:
-        return await remember_event_redis(event_key, ttl)  # должен вернуть bool
-    except RedisError as exc:
-        logging.exception("Redis error during idempotency check")
-        return None
+def remember_locally(event_key: str) -> None:
+    _processed_events[event_key] = time.time()
+    _processed_events.move_to_end(event_key)
+    while len(_processed_events) > settings.WEBHOOK_DEDUP_LOCAL_SIZE:
+        _processed_events.popitem(last=False)
 
 
+# --- Статус ведущей реплики бота (планировщик) ---
+@app.get("/scheduler/leader")
+async def scheduler_leader():
+    redis = await RedisClient.get_instance()
+    status_data = await LeaderElection.status(redis)
+    # node_id здесь — процесс вебхука, он в выборах не участвует
+    return {"leader": status_data["leader"], "lease_expires_in": status_data["lease_expires_in"]}
+
+
+# --- Очередь событий: длина потока и неподтверждённые события ---
+@app.get("/webhook/backlog")
+async def webhook_backlog():
+    redis = await RedisClient.get_instance()
+    return {
+        **await get_stream_backlog(redis),
+        "dedup": dedup_stats,
+        "telegram_delivery": await TelegramDelivery.get_metrics(redis),
+    }
+
 
 # --- Эндпоинт вебхука ---
 @app.post("/webhook")
 async def pyrus_webhook(
     request: Request,
-    background_tasks: BackgroundTasks,
     x_pyrus_sig: Optional[str] = Header(None, alias="X-Pyrus-Sig"),
     x_pyrus_retry: Optional[str] = Header(None, alias="X-Pyrus-Retry"),
     user_agent: Optional[str] = Header(None, alias="User-Agent"),
 ):
     """
     Обрабатывает входящий POST от Pyrus.
-    Проверяет подпись, возвращает 2xx быстро и ставит фоновую задачу для тяжёлой логики.
+    Проверяет подпись, отбрасывает повторные доставки и кладёт исходное тело запроса в очередь —
+    один запрос к Redis. Поиск получателя и обработку события выполняет воркер.
     """
     body = await request.body()
-    data = json.loads(body)
-
-    # print(json.dumps(data, ensure_ascii=False, indent=2))
 
     # Проверка User-Agent (рекомендуется)
     if user_agent and not user_agent.startswith("Pyrus-Bot-"):
@@ -104,31 +122,41 @@ async def pyrus_webhook(
 
     # Проверяем подпись
     if settings.WEBHOOK_SECURITY_KEY:
-        print(settings.WEBHOOK_SECURITY_KEY)
         if not verify_signature(x_pyrus_sig, body):
             logging.warning("Invalid or missing X-Pyrus-Sig header")
             raise HTTPException(status_code=403, detail="Invalid signature")
 
     try:
-
-        event = data.get("event")
-        task_id = data.get("task_id")
-
-        cache = await get_cache(task_id)
-        if not cache:
-            cache = await find_user_id(data)
-            await save_cache(task_id, cache, IDEPT_TTL)
-
-        data["user_id"] = cache
-
-    except Exception as exc:
+        event_key = event_identity(json.loads(body))
+    except Exception:
         logging.exception("Invalid payload")
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
+    if seen_locally(event_key):
+        return duplicate_response(event_key, "duplicates_local", x_pyrus_retry)
+
+    try:
+        # Ключ дедупликации и запись в очередь — одним запросом к Redis
+        entry_id = await process_event(body, dedup_key=make_event_key(event_key), dedup_ttl=IDEPT_TTL)
+    except RedisError:
+        logging.exception("Failed to enqueue Pyrus webhook")
+        # Pyrus повторит доставку
+        raise HTTPException(status_code=503, detail="Queue unavailable")
+
+    remember_locally(event_key)
+    if entry_id is None:
+        return duplicate_response(event_key, "duplicates_redis", x_pyrus_retry)
+    dedup_stats["accepted"] += 1
 
     # Логируем попытку (retry)
-    logging.info("Received Pyrus webhook: event=%s task_id=%s retry=%s", event, task_id, x_pyrus_retry)
+    logging.info("Received Pyrus webhook: entry=%s event=%s retry=%s", entry_id, event_key, x_pyrus_retry)
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content={})
 
-    background_tasks.add_task(process_event, data)
 
+def duplicate_response(event_key: str, counter: str, x_pyrus_retry: Optional[str]) -> JSONResponse:
+    dedup_stats[counter] += 1
+    if x_pyrus_retry:
+        dedup_stats["duplicates_retry"] += 1
+    logging.info("Duplicate Pyrus webhook dropped: event=%s retry=%s (%s)", event_key, x_pyrus_retry, counter)
     return JSONResponse(status_code=status.HTTP_200_OK, content={})
@@ -4,43 +4,16 @@ import logging
 from csv import excel
 from typing import Any, Dict, List, Optional
 
-from bot.clients.redis_client import RedisClient
+from bot.services.task_chat_index import TaskChatIndex
 from config import settings
 
-CACHE_TTL_SECONDS = settings.PYRUS_IDEMPOTENT_TTL
+async def get_cache(task_id: int) -> Optional[int]:
+    """chat_id автора задачи из индекса задача -> chat_id"""
+    return await TaskChatIndex.get(task_id)
 
-async def get_cache(
-    task_id: int,
-    redis_key_template: str = "webhook_user_id_{task_id}",
-) -> Optional[Any]:
-
-
-    cache_key = redis_key_template.format(task_id=task_id)
-
-    redis = await RedisClient.get_instance()
-
-    # 2. Попытка получить из кеша
-    try:
-        cached_value = await redis.get(cache_key)
-        return cached_value
-    except Exception as e:
-        logging.error(e)
-        return None
-
-async def save_cache(
-    task_id: int,
-    value: int,
-    ttl: int
-):
-    try:
-        redis = await RedisClient.get_instance()
-        cache_key = f"webhook_user_id_{value}"
-        set_result = await redis.set(cache_key, value, ex=ttl)
-        logging.info(f"user_id был успешно сохранен в Redis у задачи с id: {task_id}")
-        return set_result
-    except Exception as e:
-        logging.error(f"Ошибка при сохранении в кэш: {e}")
-        return False
+async def save_cache(task_id: int, value: int) -> None:
+    await TaskChatIndex.set(task_id, value)
+    logging.info(f"user_id был успешно сохранен в Redis у задачи с id: {task_id}")
 
 
 
@@ -56,3 +29,15 @@ async def find_user_id(
             value = field.get("value")
             return value
     return None
+
+
+async def resolve_user_id(payload: Dict[str, Any]) -> Optional[Any]:
+    """Telegram user_id получателя события: из кеша по задаче, иначе из полей задачи"""
+    task_id = payload.get("task_id")
+    user_id = await get_cache(task_id)
+    if not user_id:
+        # Задача создана не ботом или запись истекла — берём из полей и обновляем индекс
+        user_id = await find_user_id(payload)
+        if user_id:
+            await save_cache(task_id, user_id)
+    return user_id
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+_Job = Callable[[], Awaitable[None]]
+
+
+class KeyedExecutor:
+    """
+    Исполнитель с разбиением по ключу (task_id):
+    - задания с одним ключом выполняются строго по очереди, в порядке submit;
+    - задания с разными ключами — параллельно, не больше max_parallel одновременно;
+    - submit ждёт, пока в исполнителе меньше max_pending заданий, чтобы чтение очереди
+      не обгоняло обработку.
+    """
+
+    def __init__(self, max_parallel: int, max_pending: int | None = None):
+        self.max_parallel = max_parallel
+        self.max_pending = max_pending or max_parallel * 4
+        self._queues: Dict[Hashable, Deque[_Job]] = {}
+        self._slots = asyncio.Semaphore(max_parallel)
+        self._pending = 0
+        self._has_room = asyncio.Condition()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def submit(self, key: Hashable, job: _Job) -> None:
+        """Ставит задание в очередь ключа; возвращается сразу после постановки"""
+        async with self._has_room:
+            await self._has_room.wait_for(lambda: self._pending < self.max_pending)
+            self._pending += 1
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # Ключ уже обрабатывается — задание выполнится после предыдущих
+            queue.append(job)
+            return
+
+        self._queues[key] = deque([job])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def join(self) -> None:
+        """Ждёт завершения всех поставленных заданий"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    async def _drain(self, key: Hashable) -> None:
+        queue = self._queues[key]
+        while queue:
+            job = queue[0]
+            try:
+                async with self._slots:
+                    await job()
+            except Exception as e:
+                logger.exception(f"Ошибка обработки задания для ключа {key}: {e}")
+            finally:
+                queue.popleft()
+                async with self._has_room:
+                    self._pending -= 1
+                    self._has_room.notify_all()
+        del self._queues[key]
@@ -2,6 +2,7 @@ from aiogram import Bot
 from aiogram.fsm.storage.base import StorageKey
 from aiogram.fsm.context import FSMContext
 from bot.clients.bot_client import BotClient
+from bot.services.telegram_delivery import TelegramDelivery
 import logging
 
 async def notify_user_and_clear_state(user_id: int, new_message_text: str,
@@ -10,7 +11,10 @@ async def notify_user_and_clear_state(user_id: int, new_message_text: str,
     - user_id: telegram user id (в приватном чате chat_id == user_id)
     - new_message_text: текст, который нужно отправить пользователю
     - если нужно переслать конкретное сообщение, укажи forward_from_chat_id и forward_message_id
+    Сообщения ставятся в очередь TelegramDelivery, отправка — с учётом лимитов Telegram.
+    Ошибки постановки в очередь пробрасываются: вызывающий не подтверждает событие и повторит его.
     """
+    apologize = False
     try:
         bot_client = BotClient.get_instance()
         bot: Bot = bot_client
@@ -27,16 +31,18 @@ async def notify_user_and_clear_state(user_id: int, new_message_text: str,
         if current_state:
             fsm = FSMContext(storage=storage, key=key)
             await fsm.clear()
-
-            apologize_text = (
-                "🙏 Извините — у вас был незавершённый диалог с ботом, "
-                "мы автоматически его закрыли 🗑 и получили новое сообщение ✉️."
-            )
-            await bot.send_message(chat_id=user_id, text=apologize_text)
-
-
-        await bot.send_message(chat_id=user_id, text=new_message_text)
-        logging.info(f"Сообщение #{message_id} было успешно отправлено пользователю #{user_id}")
+            apologize = True
 
     except Exception as e:
-        logging.exception(f"Ошибка при отправке сообщения #{message_id} пользователю #{user_id}:\n{e}")
\ No newline at end of file
+        # Не удалось сбросить диалог — сообщение всё равно доставляем
+        logging.exception(f"Ошибка при сбросе состояния пользователя #{user_id} перед сообщением #{message_id}:\n{e}")
+
+    if apologize:
+        apologize_text = (
+            "🙏 Извините — у вас был незавершённый диалог с ботом, "
+            "мы автоматически его закрыли 🗑 и получили новое сообщение ✉️."
+        )
+        await TelegramDelivery.enqueue(chat_id=user_id, text=apologize_text)
+
+    await TelegramDelivery.enqueue(chat_id=user_id, text=new_message_text)
+    logging.info(f"Сообщение #{message_id} поставлено в очередь отправки пользователю #{user_id}")
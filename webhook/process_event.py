@@ -1,108 +1,346 @@
 import asyncio
 import json
 import logging
+import os
+import socket
+import time
+from typing import Dict
+
 from redis.asyncio import Redis
+from redis.exceptions import ResponseError
 
 from bot.clients.redis_client import RedisClient
+from bot.scheduler import handle_task_state_change
+from bot.services.task_chat_index import TaskChatIndex
+from bot.services.telegram_delivery import TelegramDelivery
 from config import settings
+from webhook.get_user_id import resolve_user_id
+from webhook.keyed_executor import KeyedExecutor
 from webhook.notify_user_and_clear_state import notify_user_and_clear_state
 
 logging.basicConfig(level=logging.INFO)
 
 # Настройки
-QUEUE_KEY = "pyrus:event:queue"
+STREAM_KEY = "pyrus:event:stream"
+GROUP_NAME = "pyrus:event:workers"
 COMMENTS_TTL = settings.PYRUS_IDEMPOTENT_TTL
+# Id последнего доставленного пользователю комментария задачи
+COMMENT_WATERMARK_KEY = "comment_watermark:{task_id}"
 LOCK_TTL = 30  # сек
+CONSUMER_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
+# Ставит событие в поток, только если ключ дедупликации ещё не занят
+_ENQUEUE_ONCE_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'event', ARGV[3])
+end
+return false
+"""
+_enqueue_once_script = None
+
+# Compare-and-set отметки комментариев: сдвигает только вперёд, возвращает прежнее значение
+_ADVANCE_WATERMARK_SCRIPT = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > previous then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return tostring(previous)
+"""
+_advance_watermark_script = None
 
 redis_client: Redis | None = None
+# Записи потока, уже поставленные в исполнитель этого процесса
+_in_flight: set[str] = set()
 
 # ---------- Продюсер ----------
-async def process_event(event):
+async def process_event(body: bytes, dedup_key: str | None = None, dedup_ttl: int = COMMENTS_TTL) -> str | None:
     """
-    Вместо обработки сразу — кладём в очередь Redis.
+    Вместо обработки сразу — кладём тело запроса в поток Redis как есть,
+    поиск получателя делает воркер.
+    С dedup_key событие ставится, только если ключ ещё не занят (SET NX EX) — атомарно,
+    одним запросом; для дубликата возвращается None.
     """
-    task_id = event.get("task_id")
     redis = await RedisClient.get_instance()
-    event_json = json.dumps(event)
-    await redis.rpush(QUEUE_KEY, event_json)
-    logging.info(f"[QUEUE] Добавлено событие task_id={task_id}")
+    if dedup_key is None:
+        entry_id = await redis.xadd(
+            STREAM_KEY, {"event": body}, maxlen=settings.WEBHOOK_STREAM_MAXLEN, approximate=True
+        )
+    else:
+        global _enqueue_once_script
+        if _enqueue_once_script is None:
+            _enqueue_once_script = redis.register_script(_ENQUEUE_ONCE_SCRIPT)
+        entry_id = await _enqueue_once_script(
+            keys=[dedup_key, STREAM_KEY], args=[dedup_ttl, settings.WEBHOOK_STREAM_MAXLEN, body]
+        )
+        if entry_id is None:
+            return None
+    logging.info(f"[QUEUE] Добавлено событие {entry_id}")
+    return entry_id
+
+
+async def get_comment_watermark(redis: Redis, task_id: int) -> int:
+    """Id последнего доставленного комментария задачи (0 — комментарии ещё не доставлялись)"""
+    return int(await redis.get(COMMENT_WATERMARK_KEY.format(task_id=task_id)) or 0)
+
+
+async def advance_comment_watermark(redis: Redis, task_id: int, comment_id: int) -> int:
+    """
+    Сдвигает отметку последнего доставленного комментария задачи до comment_id (только вперёд)
+    и возвращает прежнюю отметку (0 — комментарии задачи ещё не доставлялись).
+    """
+    global _advance_watermark_script
+    if _advance_watermark_script is None:
+        _advance_watermark_script = redis.register_script(_ADVANCE_WATERMARK_SCRIPT)
+    previous = await _advance_watermark_script(
+        keys=[COMMENT_WATERMARK_KEY.format(task_id=task_id)],
+        args=[comment_id, settings.COMMENT_WATERMARK_TTL],
+    )
+    return int(previous)
+
+
+# ---------- Метрики ----------
+async def get_stream_backlog(redis: Redis) -> Dict[str, int]:
+    """Длина потока и число событий, выданных воркерам, но ещё не подтверждённых"""
+    length = await redis.xlen(STREAM_KEY)
+    try:
+        pending = (await redis.xpending(STREAM_KEY, GROUP_NAME))["pending"]
+    except ResponseError:  # группа ещё не создана
+        pending = 0
+    return {"length": length, "pending": pending}
 
 
 # ---------- Воркер ----------
-async def worker():
-    redis = await RedisClient.get_instance()
-    await redis.flushall()
-    logging.info(f"[WORKER] Слушаю очередь {QUEUE_KEY}...")
+async def ensure_consumer_group(redis: Redis) -> None:
+    try:
+        await redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+        logging.info(f"[WORKER] Создана группа {GROUP_NAME} для потока {STREAM_KEY}")
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
 
-    while True:
-        try:
-            logging.info("[WORKER] Ожидаю событие...")
-            result = await redis.blpop([QUEUE_KEY], timeout=0)  # ждать бесконечно
 
-            if not result:
-                print("Результата нет")
-                continue
+async def acquire_task_lock(redis: Redis, lock_key: str) -> bool:
+    """Ждёт блокировку задачи, пока её держит другой процесс воркера (не дольше LOCK_TTL)"""
+    deadline = time.monotonic() + LOCK_TTL
+    while not await redis.set(lock_key, "1", ex=LOCK_TTL, nx=True):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.1)
+    return True
 
-            _, event = result
 
-            event = json.loads(event)
+async def handle_event(redis: Redis, event: Dict) -> bool:
+    """
+    Обрабатывает одно событие. Возвращает False, если блокировку задачи не удалось получить
+    за LOCK_TTL — тогда process_entry повторяет событие, не переходя к следующим событиям задачи.
+    """
+    task_id = event.get("task_id")
+    lock_key = f"lock:task:{task_id}"
 
-            task_id = event.get("task_id")
-            lock_key = f"lock:task:{task_id}"
+    # Локировка на время обработки: события одной задачи в этом процессе уже упорядочены
+    # исполнителем, блокировка нужна против других процессов воркера
+    if not await acquire_task_lock(redis, lock_key):
+        logging.warning(f"[BUSY] Задача {task_id} занята дольше {LOCK_TTL}с, событие будет обработано позже")
+        return False
 
-            # Локировка на время обработки
-            if not await redis.set(lock_key, "1", ex=LOCK_TTL, nx=True):
-                logging.info(f"[SKIP] Задача {task_id} уже обрабатывается")
-                continue
+    try:
+        logging.info(f"[PROCESS] task_id={task_id}, event={event.get('event')}")
 
-            try:
-                logging.info(f"[PROCESS] task_id={task_id}, event={event.get('event')}")
+        # Закрытие/переоткрытие задачи: сообщение о завершении и окно переоткрытия
+        try:
+            await handle_task_state_change(event.get("task") or {})
+        except Exception as e:
+            logging.exception(f"[STATE] Ошибка обработки закрытия/переоткрытия задачи {task_id}: {e}")
+
+        comments_with_channel = [
+            c for c in (event.get("task", {}).get("comments") or [])
+            if c.get("channel") is not None or c.get("action") == "reopened"
+        ]
+        if not comments_with_channel:
+            logging.info(f"[NO COMMENTS] Нет комментариев с channel у {task_id}")
+            return True
 
-                comments_with_channel = [
-                    c for c in (event.get("task", {}).get("comments") or [])
-                    if c.get("channel") is not None or c.get("action") == "reopened"
-                ]
-                if not comments_with_channel:
-                    logging.info(f"[NO COMMENTS] Нет комментариев с channel у {task_id}")
-                    continue
+        # Доставляем только комментарии после последнего переоткрытия задачи
+        reopened_at = next(
+            (i for i in range(len(comments_with_channel) - 1, -1, -1)
+             if comments_with_channel[i].get("action") == "reopened"),
+            -1,
+        )
+        candidates = [c for c in comments_with_channel[reopened_at + 1:] if c.get("channel") is not None]
+        if not candidates:
+            logging.info(f"[NO NEW] Нет комментариев после переоткрытия у {task_id}")
+            return True
 
-                with open("comments.json", "w", encoding="utf-8") as f:
-                    json.dump(list(reversed(comments_with_channel)), f, indent=4, ensure_ascii=False)
+        previous_id = await get_comment_watermark(redis, task_id)
+        new_comments = [c for c in candidates if int(c["id"]) > previous_id]
+        if not new_comments:
+            logging.info(f"[STOP-DUP] Комментарии задачи {task_id} до {previous_id} уже обработаны")
+            return True
 
-                user_id = event.get("user_id")
-                print(user_id)
-                for c in reversed(comments_with_channel):
-                    comment_key = f"comment:{c['id']}"
+        user_id = await resolve_user_id(event)
+        queued_id = previous_id
+        try:
+            for c in new_comments:
+                text = c.get("text")
+                message_id = c.get("id")
+                await notify_user_and_clear_state(user_id, text, message_id)
+                queued_id = int(c["id"])
 
-                    logging.info(f"Обрабатывается комментарий с id: {c['id']}")
+                logging.info(f"[PROCESS] комментарий {c['id']} успешно обработан!")
+        finally:
+            # Отметка сдвигается только до последнего поставленного в очередь комментария:
+            # при ошибке событие не подтверждается, и повтор доставит оставшиеся
+            if queued_id > previous_id:
+                await advance_comment_watermark(redis, task_id, queued_id)
 
-                    if c.get("action") == "reopened":
-                        logging.info(f"[STOP-REOPENED] Обработан комментарий с id: {c['id']} с событием 'Переоткрытие задачи', — останавливаемся.")
-                        break
+        logging.info(f"[DONE] Задача c id: {task_id} успешно обработана!")
+        return True
 
-                    if await redis.exists(comment_key):
-                        logging.info(f"[STOP-DUP] {c['id']} уже обработан")
+    finally:
+        await redis.delete(lock_key)
+
+
+async def process_entry(redis: Redis, executor: KeyedExecutor, entry_id: str, fields: Dict) -> None:
+    """
+    Ставит запись потока в очередь её задачи. Запись подтверждается (XACK) после успешной обработки.
+    Неудачная обработка повторяется на месте, пока следующие события задачи ждут: иначе они обогнали бы
+    это событие (например, устаревшее «задача закрыта» пришло бы после переоткрытия).
+    После WEBHOOK_MAX_DELIVERIES попыток событие подтверждается без обработки, как и в reclaim_pending.
+    """
+    if entry_id in _in_flight:
+        return
+    try:
+        event = json.loads(fields["event"])
+    except (KeyError, TypeError, ValueError) as e:
+        logging.error(f"[BROKEN] Запись {entry_id} не разобрана и будет подтверждена без обработки: {e}")
+        await redis.xack(STREAM_KEY, GROUP_NAME, entry_id)
+        return
+
+    async def job() -> None:
+        try:
+            for attempt in range(1, settings.WEBHOOK_MAX_DELIVERIES + 1):
+                try:
+                    if await handle_event(redis, event):
                         break
+                except Exception as e:
+                    logging.exception(f"[ERROR] Ошибка обработки события {entry_id}, попытка {attempt}: {e}")
+                if attempt < settings.WEBHOOK_MAX_DELIVERIES:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+            else:
+                logging.error(
+                    f"[DROP] Событие {entry_id} не обработано за {settings.WEBHOOK_MAX_DELIVERIES} попыток: {event}"
+                )
+            await redis.xack(STREAM_KEY, GROUP_NAME, entry_id)
+        finally:
+            _in_flight.discard(entry_id)
 
-                    await redis.set(comment_key, "1", ex=COMMENTS_TTL)
-                    logging.info(f"[NEW] {c['id']} сохранён в Redis")
+    _in_flight.add(entry_id)
+    await executor.submit(event.get("task_id"), job)
 
-                    text = c.get("text")
-                    message_id = c.get("id")
-                    asyncio.create_task(notify_user_and_clear_state(user_id, text, message_id))
 
-                    logging.info(f"[PROCESS] комментарий {c['id']} успешно обработан!")
+async def reclaim_pending(redis: Redis, executor: KeyedExecutor) -> None:
+    """
+    Забирает события, зависшие у упавших воркеров дольше WEBHOOK_CLAIM_MIN_IDLE_MS (XAUTOCLAIM).
+    События, выданные больше WEBHOOK_MAX_DELIVERIES раз, подтверждаются без обработки.
+    """
+    start_id = "0-0"
+    while True:
+        result = await redis.xautoclaim(
+            STREAM_KEY, GROUP_NAME, CONSUMER_NAME,
+            min_idle_time=settings.WEBHOOK_CLAIM_MIN_IDLE_MS,
+            start_id=start_id,
+            count=settings.WEBHOOK_STREAM_BATCH,
+        )
+        start_id, claimed = result[0], result[1]
+        for entry_id, fields in claimed:
+            if entry_id in _in_flight:  # ещё ждёт своей очереди в этом процессе
+                continue
+            if fields is None:  # запись уже удалена из потока по MAXLEN
+                await redis.xack(STREAM_KEY, GROUP_NAME, entry_id)
+                continue
+            pending = await redis.xpending_range(STREAM_KEY, GROUP_NAME, min=entry_id, max=entry_id, count=1)
+            if pending and pending[0]["times_delivered"] > settings.WEBHOOK_MAX_DELIVERIES:
+                logging.error(f"[DROP] Событие {entry_id} не обработано за {settings.WEBHOOK_MAX_DELIVERIES} попыток: {fields}")
+                await redis.xack(STREAM_KEY, GROUP_NAME, entry_id)
+                continue
+            logging.info(f"[RECLAIM] {CONSUMER_NAME} забрал зависшее событие {entry_id}")
+            await process_entry(redis, executor, entry_id, fields)
+        if start_id in ("0-0", b"0-0"):
+            break
+
 
-                logging.info(f"[DONE] Задача c id: {task_id} успешно обработана!")
+async def keep_in_flight_claimed(redis: Redis) -> None:
+    """
+    Сбрасывает время простоя (XCLAIM JUSTID себе же) у записей, которые ждут в исполнителе
+    этого процесса, — иначе запись занятой задачи дольше WEBHOOK_CLAIM_MIN_IDLE_MS забрал бы
+    XAUTOCLAIM другого процесса и обработал её второй раз, нарушив порядок задачи.
+    """
+    interval = settings.WEBHOOK_CLAIM_MIN_IDLE_MS / 1000 / 3
+    while True:
+        await asyncio.sleep(interval)
+        entry_ids = list(_in_flight)
+        try:
+            for i in range(0, len(entry_ids), 100):
+                await redis.xclaim(
+                    STREAM_KEY, GROUP_NAME, CONSUMER_NAME,
+                    min_idle_time=0, message_ids=entry_ids[i:i + 100], justid=True,
+                )
+        except Exception as e:
+            logging.error(f"[HEARTBEAT] Не удалось продлить записи в обработке: {e}")
 
-            finally:
-                await redis.delete(lock_key)
+
+async def consumer(redis: Redis, executor: KeyedExecutor) -> None:
+    last_claim = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_claim >= settings.WEBHOOK_CLAIM_INTERVAL:
+                last_claim = time.monotonic()
+                await reclaim_pending(redis, executor)
+
+            response = await redis.xreadgroup(
+                GROUP_NAME, CONSUMER_NAME, {STREAM_KEY: ">"},
+                count=settings.WEBHOOK_STREAM_BATCH, block=5000,
+            )
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    await process_entry(redis, executor, entry_id, fields)
 
         except Exception as e:
-            logging.exception(f"[ERROR] Worker поймал исключение: {e}")
+            logging.exception(f"[ERROR] {CONSUMER_NAME} поймал исключение: {e}")
             await asyncio.sleep(1)  # Пауза, чтобы не крутить цикл слишком быстро
 
 
+async def log_stream_backlog(redis: Redis, executor: KeyedExecutor) -> None:
+    while True:
+        try:
+            backlog = await get_stream_backlog(redis)
+            index_stats = TaskChatIndex.get_stats()
+            logging.info(
+                f"[BACKLOG] Событий в потоке: {backlog['length']}, не подтверждено: {backlog['pending']}, "
+                f"в исполнителе процесса: {executor.pending}; "
+                f"индекс задача->чат: попаданий {index_stats['hits']}, промахов {index_stats['misses']} "
+                f"({index_stats['hit_rate']:.0%})"
+            )
+        except Exception as e:
+            logging.error(f"[BACKLOG] Не удалось получить длину потока: {e}")
+        await asyncio.sleep(settings.WEBHOOK_CLAIM_INTERVAL)
+
+
+async def worker():
+    redis = await RedisClient.get_instance()
+    await ensure_consumer_group(redis)
+    executor = KeyedExecutor(settings.WEBHOOK_PARTITIONS)
+    logging.info(f"[WORKER] {CONSUMER_NAME} слушаю поток {STREAM_KEY}, параллельных задач: {executor.max_parallel}")
+    await asyncio.gather(
+        log_stream_backlog(redis, executor),
+        consumer(redis, executor),
+        keep_in_flight_claimed(redis),
+        TelegramDelivery.run(),
+    )
+
+
 # ---------- Точка входа для воркера ----------
 if __name__ == "__main__":
     logging.basicConfig(